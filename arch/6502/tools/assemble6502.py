@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+"""
+assemble6502.py - Assembles the subset of Ophis syntax used by the 6502 files.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from cpu6502 import opcodes, operand_sizes
+import os, re, sys
+
+def usage(args):
+    sys.stderr.write("usage: %s <oph file> <output file>\n" % sys.argv[0])
+    sys.exit(1)
+
+class AssemblyError(Exception):
+    pass
+
+# Map (name, mode) pairs to opcodes.
+encodings = {}
+for opcode, (name, mode, cycles, penalty) in opcodes.items():
+    encodings[(name, mode)] = opcode
+
+label_re = re.compile(r"^([A-Za-z_][A-Za-z0-9_]*):")
+token_re = re.compile(r"\s*(\$[0-9A-Fa-f]+|%[01]+|[0-9]+|[A-Za-z_][A-Za-z0-9_]*|[-+*/&|^<>\[\]])")
+
+def read_lines(path, overrides, lines):
+
+    # Append (path, line number, text) tuples for the file to the list of
+    # lines, expanding included files. The overrides dictionary maps file
+    # names to text used instead of the contents of those files.
+    name = os.path.basename(path)
+    if name in overrides:
+        text = overrides[name]
+    else:
+        text = open(path).read()
+
+    for number, line in enumerate(text.splitlines(), 1):
+        at = line.find(";")
+        if at != -1:
+            line = line[:at]
+        line = line.strip()
+        if line.startswith(".include"):
+            included = line[len(".include"):].strip().strip('"')
+            read_lines(os.path.join(os.path.dirname(path), included),
+                       overrides, lines)
+        elif line:
+            lines.append((path, number, line))
+
+class Expression:
+
+    def __init__(self, text, symbols):
+        self.tokens = []
+        pos = 0
+        while pos < len(text):
+            match = token_re.match(text, pos)
+            if not match:
+                raise AssemblyError("invalid expression '%s'" % text)
+            self.tokens.append(match.group(1))
+            pos = match.end()
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+        self.symbols = symbols
+
+    def evaluate(self):
+
+        # Return the value of the expression, or None if it refers to a symbol
+        # that is not yet defined.
+        self.pos = 0
+        value = self.binary(0)
+        if self.pos != len(self.tokens):
+            raise AssemblyError("unexpected '%s'" % self.tokens[self.pos])
+        return value
+
+    levels = [("|",), ("^",), ("&",), ("+", "-"), ("*", "/")]
+
+    def binary(self, level):
+        if level == len(self.levels):
+            return self.unary()
+        value = self.binary(level + 1)
+        while self.pos < len(self.tokens) and self.tokens[self.pos] in self.levels[level]:
+            op = self.tokens[self.pos]
+            self.pos += 1
+            other = self.binary(level + 1)
+            if value is None or other is None:
+                value = None
+            elif op == "|": value |= other
+            elif op == "^": value ^= other
+            elif op == "&": value &= other
+            elif op == "+": value += other
+            elif op == "-": value -= other
+            elif op == "*": value *= other
+            else: value //= other
+        return value
+
+    def unary(self):
+        if self.pos == len(self.tokens):
+            raise AssemblyError("incomplete expression")
+        token = self.tokens[self.pos]
+        self.pos += 1
+        if token in ("<", ">", "-"):
+            value = self.unary()
+            if value is None:
+                return None
+            elif token == "<":
+                return value & 0xff
+            elif token == ">":
+                return (value >> 8) & 0xff
+            else:
+                return -value
+        elif token == "[":
+            value = self.binary(0)
+            if self.pos == len(self.tokens) or self.tokens[self.pos] != "]":
+                raise AssemblyError("missing ']'")
+            self.pos += 1
+            return value
+        elif token[0] == "$":
+            return int(token[1:], 16)
+        elif token[0] == "%":
+            return int(token[1:], 2)
+        elif token[0].isdigit():
+            return int(token)
+        elif token[0].isalpha() or token[0] == "_":
+            return self.symbols.get(token)
+        else:
+            raise AssemblyError("unexpected '%s'" % token)
+
+def parse_operand(name, operand):
+
+    # Return the addressing modes that the operand could use and the text of
+    # its expression.
+    low = operand.lower().replace(" ", "")
+    if not operand or low == "a":
+        if (name, "acc") in encodings:
+            return ["acc"], ""
+        return ["imp"], ""
+    elif operand.startswith("#"):
+        return ["imm"], operand[1:]
+    elif low.startswith("(") and low.endswith("),y"):
+        return ["indy"], operand[1:operand.rindex(")")]
+    elif low.startswith("(") and low.endswith(",x)"):
+        return ["indx"], operand[1:operand.rindex(",")]
+    elif low.startswith("(") and low.endswith(")"):
+        return ["ind"], operand[1:-1]
+    elif low.endswith(",x"):
+        return ["zpx", "absx"], operand[:operand.rindex(",")]
+    elif low.endswith(",y"):
+        return ["zpy", "absy"], operand[:operand.rindex(",")]
+    elif (name, "rel") in encodings:
+        return ["rel"], operand
+    else:
+        return ["zp", "abs"], operand
+
+def assemble(path, overrides={}):
+
+    # Assemble the file, returning the origin, the assembled bytes and a
+    # dictionary of symbols.
+    lines = []
+    read_lines(path, overrides, lines)
+
+    symbols = {}
+    previous = None
+    for attempt in range(16):
+        origin, output, symbols, anonymous = assemble_pass(lines, symbols, previous)
+        # Repeat until the addresses of symbols no longer change, since the
+        # sizes of instructions depend on them.
+        if symbols == previous:
+            break
+        previous = dict(symbols)
+    else:
+        raise AssemblyError("addresses of symbols did not settle")
+
+    origin, output, symbols, anonymous = assemble_pass(lines, symbols, symbols, True)
+    return origin, bytes(output), symbols
+
+def assemble_pass(lines, known, previous, final=False):
+
+    symbols = dict(known)
+    origin = addr = None
+    output = bytearray()
+    # Find the addresses of anonymous labels for use in this pass.
+    anonymous = known.get("*", [])
+    anonymous_here = []
+
+    for path, number, line in lines:
+        try:
+            match = label_re.match(line)
+            if match:
+                symbols[match.group(1)] = addr
+                line = line[match.end():].strip()
+            elif line.startswith("*") and (len(line) == 1 or line[1].isspace()):
+                anonymous_here.append(addr)
+                line = line[1:].strip()
+            if not line:
+                continue
+
+            pieces = line.split(None, 1)
+            name = pieces[0].lower()
+            operand = pieces[1].strip() if len(pieces) > 1 else ""
+
+            if name == ".org":
+                addr = Expression(operand, symbols).evaluate()
+                if origin is None:
+                    origin = addr
+                elif addr < origin + len(output):
+                    raise AssemblyError(".org moves backwards")
+                else:
+                    output += bytes(addr - origin - len(output))
+                continue
+            elif name == ".alias":
+                alias, value = operand.split(None, 1)
+                symbols[alias] = Expression(value, symbols).evaluate()
+                continue
+
+            if addr is None:
+                raise AssemblyError("code before .org")
+
+            if name in (".byte", ".word"):
+                size = 1 if name == ".byte" else 2
+                for item in operand.split(","):
+                    value = Expression(item.strip(), symbols).evaluate()
+                    if value is None:
+                        if final: raise AssemblyError("undefined symbol in '%s'" % item)
+                        value = 0
+                    output += (value & 0xffff).to_bytes(2, "little")[:size]
+                    addr += size
+                continue
+
+            modes, text = parse_operand(name, operand)
+            if text.strip() in ("+", "++", "-", "--"):
+                value = anonymous_target(anonymous, len(anonymous_here), text.strip())
+            elif text:
+                value = Expression(text, symbols).evaluate()
+            else:
+                value = None
+
+            mode = choose_mode(name, modes, value)
+            opcode = encodings[(name, mode)]
+            output.append(opcode)
+            size = operand_sizes[mode]
+
+            if value is None:
+                if final and size:
+                    raise AssemblyError("undefined symbol in '%s'" % text)
+                value = 0
+            if mode == "rel":
+                offset = value - (addr + 2)
+                if final and not -128 <= offset < 128:
+                    raise AssemblyError("branch out of range")
+                value = offset & 0xff
+            if size:
+                output += (value & 0xffff).to_bytes(2, "little")[:size]
+            addr += 1 + size
+
+        except (AssemblyError, KeyError, ValueError) as e:
+            if isinstance(e, KeyError):
+                e = "invalid instruction '%s'" % line
+            raise AssemblyError("%s on line %i of %s" % (e, number, path))
+
+    symbols["*"] = anonymous_here
+    return origin, output, symbols, anonymous_here
+
+def anonymous_target(anonymous, count, ref):
+
+    # Return the address of the anonymous label referred to, where count is
+    # the number of anonymous labels already seen in this pass.
+    if ref[0] == "+":
+        index = count + len(ref) - 1
+    else:
+        index = count - len(ref)
+    if 0 <= index < len(anonymous):
+        return anonymous[index]
+    return None
+
+def choose_mode(name, modes, value):
+
+    # Use zero page addressing if the value is known to be in zero page.
+    if len(modes) == 1:
+        return modes[0]
+    zp, absolute = modes
+    if value is not None and 0 <= value < 0x100 and (name, zp) in encodings:
+        return zp
+    return absolute
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    if len(args) != 3:
+        usage(args)
+
+    try:
+        origin, output, symbols = assemble(args[1])
+    except AssemblyError as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(1)
+
+    open(args[2], "wb").write(output)
+    sys.exit()
@@ -0,0 +1,428 @@
+"""
+cpu6502.py - A cycle-counting 6502 CPU emulator.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# The documented NMOS 6502 instructions, each with its opcode, addressing mode
+# and number of cycles. A + after the number of cycles indicates that an
+# extra cycle is needed if the address crosses a page boundary.
+opcode_table = """
+69 adc imm 2    65 adc zp 3     75 adc zpx 4    6d adc abs 4
+7d adc absx 4+  79 adc absy 4+  61 adc indx 6   71 adc indy 5+
+29 and imm 2    25 and zp 3     35 and zpx 4    2d and abs 4
+3d and absx 4+  39 and absy 4+  21 and indx 6   31 and indy 5+
+0a asl acc 2    06 asl zp 5     16 asl zpx 6    0e asl abs 6
+1e asl absx 7   90 bcc rel 2    b0 bcs rel 2    f0 beq rel 2
+24 bit zp 3     2c bit abs 4    30 bmi rel 2    d0 bne rel 2
+10 bpl rel 2    00 brk imp 7    50 bvc rel 2    70 bvs rel 2
+18 clc imp 2    d8 cld imp 2    58 cli imp 2    b8 clv imp 2
+c9 cmp imm 2    c5 cmp zp 3     d5 cmp zpx 4    cd cmp abs 4
+dd cmp absx 4+  d9 cmp absy 4+  c1 cmp indx 6   d1 cmp indy 5+
+e0 cpx imm 2    e4 cpx zp 3     ec cpx abs 4    c0 cpy imm 2
+c4 cpy zp 3     cc cpy abs 4    c6 dec zp 5     d6 dec zpx 6
+ce dec abs 6    de dec absx 7   ca dex imp 2    88 dey imp 2
+49 eor imm 2    45 eor zp 3     55 eor zpx 4    4d eor abs 4
+5d eor absx 4+  59 eor absy 4+  41 eor indx 6   51 eor indy 5+
+e6 inc zp 5     f6 inc zpx 6    ee inc abs 6    fe inc absx 7
+e8 inx imp 2    c8 iny imp 2    4c jmp abs 3    6c jmp ind 5
+20 jsr abs 6    a9 lda imm 2    a5 lda zp 3     b5 lda zpx 4
+ad lda abs 4    bd lda absx 4+  b9 lda absy 4+  a1 lda indx 6
+b1 lda indy 5+  a2 ldx imm 2    a6 ldx zp 3     b6 ldx zpy 4
+ae ldx abs 4    be ldx absy 4+  a0 ldy imm 2    a4 ldy zp 3
+b4 ldy zpx 4    ac ldy abs 4    bc ldy absx 4+  4a lsr acc 2
+46 lsr zp 5     56 lsr zpx 6    4e lsr abs 6    5e lsr absx 7
+ea nop imp 2    09 ora imm 2    05 ora zp 3     15 ora zpx 4
+0d ora abs 4    1d ora absx 4+  19 ora absy 4+  01 ora indx 6
+11 ora indy 5+  48 pha imp 3    08 php imp 3    68 pla imp 4
+28 plp imp 4    2a rol acc 2    26 rol zp 5     36 rol zpx 6
+2e rol abs 6    3e rol absx 7   6a ror acc 2    66 ror zp 5
+76 ror zpx 6    6e ror abs 6    7e ror absx 7   40 rti imp 6
+60 rts imp 6    e9 sbc imm 2    e5 sbc zp 3     f5 sbc zpx 4
+ed sbc abs 4    fd sbc absx 4+  f9 sbc absy 4+  e1 sbc indx 6
+f1 sbc indy 5+  38 sec imp 2    f8 sed imp 2    78 sei imp 2
+85 sta zp 3     95 sta zpx 4    8d sta abs 4    9d sta absx 5
+99 sta absy 5   81 sta indx 6   91 sta indy 6   86 stx zp 3
+96 stx zpy 4    8e stx abs 4    84 sty zp 3     94 sty zpx 4
+8c sty abs 4    aa tax imp 2    a8 tay imp 2    ba tsx imp 2
+8a txa imp 2    9a txs imp 2    98 tya imp 2
+"""
+
+# Numbers of bytes used by the operands of each addressing mode.
+operand_sizes = {
+    "imp": 0, "acc": 0, "imm": 1, "zp": 1, "zpx": 1, "zpy": 1, "rel": 1,
+    "abs": 2, "absx": 2, "absy": 2, "ind": 2, "indx": 1, "indy": 1
+    }
+
+def read_opcode_table():
+
+    # Return a dictionary mapping opcodes to (name, mode, cycles, page penalty)
+    # tuples.
+    table = {}
+    words = opcode_table.split()
+    for i in range(0, len(words), 4):
+        opcode, name, mode, cycles = words[i:i + 4]
+        table[int(opcode, 16)] = (name, mode, int(cycles.rstrip("+")),
+                                  cycles.endswith("+"))
+    return table
+
+opcodes = read_opcode_table()
+
+class Stop(Exception):
+    pass
+
+class CPU:
+
+    def __init__(self):
+
+        self.memory = bytearray(65536)
+        self.a = self.x = self.y = 0
+        self.s = 0xff
+        self.pc = 0
+        self.c = self.z = self.i = self.d = self.v = self.n = 0
+        self.cycles = 0
+        # Python functions called instead of executing code at addresses.
+        self.traps = {}
+
+        # Map opcodes to methods that execute them.
+        self.handlers = {}
+        for opcode, (name, mode, cycles, penalty) in opcodes.items():
+            self.handlers[opcode] = (getattr(self, "op_" + name), mode,
+                                     cycles, penalty)
+
+    def load(self, addr, values):
+        self.memory[addr:addr + len(values)] = values
+
+    def read_word(self, addr):
+        return self.memory[addr] | (self.memory[(addr + 1) & 0xffff] << 8)
+
+    def read_zp_word(self, addr):
+        return self.memory[addr & 0xff] | (self.memory[(addr + 1) & 0xff] << 8)
+
+    def push(self, value):
+        self.memory[0x100 + self.s] = value
+        self.s = (self.s - 1) & 0xff
+
+    def pull(self):
+        self.s = (self.s + 1) & 0xff
+        return self.memory[0x100 + self.s]
+
+    def push_word(self, value):
+        self.push(value >> 8)
+        self.push(value & 0xff)
+
+    def pull_word(self):
+        low = self.pull()
+        return low | (self.pull() << 8)
+
+    def flags(self, b=0x10):
+        return (self.n << 7) | (self.v << 6) | 0x20 | b | (self.d << 3) | \
+               (self.i << 2) | (self.z << 1) | self.c
+
+    def set_flags(self, p):
+        self.n, self.v = (p >> 7) & 1, (p >> 6) & 1
+        self.d, self.i = (p >> 3) & 1, (p >> 2) & 1
+        self.z, self.c = (p >> 1) & 1, p & 1
+
+    def set_nz(self, value):
+        self.n = value >> 7
+        self.z = int(value == 0)
+        return value
+
+    def address(self, mode, penalty):
+
+        # Return the address of the operand for the addressing mode, adding
+        # a cycle if the mode has a page crossing penalty and one occurs.
+        pc = self.pc
+        m = self.memory
+        if mode == "zp":
+            return m[pc]
+        elif mode == "zpx":
+            return (m[pc] + self.x) & 0xff
+        elif mode == "zpy":
+            return (m[pc] + self.y) & 0xff
+        elif mode == "abs":
+            return m[pc] | (m[pc + 1] << 8)
+        elif mode == "indy":
+            base = self.read_zp_word(m[pc])
+            addr = (base + self.y) & 0xffff
+        elif mode == "indx":
+            return self.read_zp_word(m[pc] + self.x)
+        elif mode == "absx":
+            base = m[pc] | (m[pc + 1] << 8)
+            addr = (base + self.x) & 0xffff
+        elif mode == "absy":
+            base = m[pc] | (m[pc + 1] << 8)
+            addr = (base + self.y) & 0xffff
+        elif mode == "ind":
+            # Reproduce the indirect jump bug at the end of a page.
+            ptr = m[pc] | (m[pc + 1] << 8)
+            return m[ptr] | (m[(ptr & 0xff00) | ((ptr + 1) & 0xff)] << 8)
+        elif mode == "imm":
+            return pc
+
+        if penalty and (base ^ addr) & 0xff00:
+            self.cycles += 1
+        return addr
+
+    def step(self):
+
+        # Execute one instruction, or call a trap for the current address.
+        trap = self.traps.get(self.pc)
+        if trap:
+            trap(self)
+            return
+
+        opcode = self.memory[self.pc]
+        try:
+            handler, mode, cycles, penalty = self.handlers[opcode]
+        except KeyError:
+            raise ValueError("Unknown opcode $%02x at $%04x." % (opcode, self.pc))
+
+        self.pc = (self.pc + 1) & 0xffff
+        self.cycles += cycles
+        handler(mode, penalty)
+        self.pc = (self.pc + operand_sizes[mode]) & 0xffff
+
+    def run(self, limit=None):
+
+        # Run until a trap raises the Stop exception or the optional cycle
+        # limit is reached.
+        try:
+            while limit is None or self.cycles < limit:
+                self.step()
+        except Stop:
+            return True
+        return False
+
+    # Instructions that read a value from memory or the operand.
+
+    def read(self, mode, penalty):
+        return self.memory[self.address(mode, penalty)]
+
+    def op_lda(self, mode, penalty):
+        self.a = self.set_nz(self.read(mode, penalty))
+
+    def op_ldx(self, mode, penalty):
+        self.x = self.set_nz(self.read(mode, penalty))
+
+    def op_ldy(self, mode, penalty):
+        self.y = self.set_nz(self.read(mode, penalty))
+
+    def op_and(self, mode, penalty):
+        self.a = self.set_nz(self.a & self.read(mode, penalty))
+
+    def op_ora(self, mode, penalty):
+        self.a = self.set_nz(self.a | self.read(mode, penalty))
+
+    def op_eor(self, mode, penalty):
+        self.a = self.set_nz(self.a ^ self.read(mode, penalty))
+
+    def op_adc(self, mode, penalty):
+        value = self.read(mode, penalty)
+        result = self.a + value + self.c
+        self.v = int(((self.a ^ result) & (value ^ result) & 0x80) != 0)
+        self.c = result >> 8
+        self.a = self.set_nz(result & 0xff)
+
+    def op_sbc(self, mode, penalty):
+        value = self.read(mode, penalty) ^ 0xff
+        result = self.a + value + self.c
+        self.v = int(((self.a ^ result) & (value ^ result) & 0x80) != 0)
+        self.c = result >> 8
+        self.a = self.set_nz(result & 0xff)
+
+    def compare(self, register, value):
+        result = register - value
+        self.c = int(result >= 0)
+        self.set_nz(result & 0xff)
+
+    def op_cmp(self, mode, penalty):
+        self.compare(self.a, self.read(mode, penalty))
+
+    def op_cpx(self, mode, penalty):
+        self.compare(self.x, self.read(mode, penalty))
+
+    def op_cpy(self, mode, penalty):
+        self.compare(self.y, self.read(mode, penalty))
+
+    def op_bit(self, mode, penalty):
+        value = self.read(mode, penalty)
+        self.n, self.v = value >> 7, (value >> 6) & 1
+        self.z = int(self.a & value == 0)
+
+    # Instructions that write to memory.
+
+    def op_sta(self, mode, penalty):
+        self.memory[self.address(mode, penalty)] = self.a
+
+    def op_stx(self, mode, penalty):
+        self.memory[self.address(mode, penalty)] = self.x
+
+    def op_sty(self, mode, penalty):
+        self.memory[self.address(mode, penalty)] = self.y
+
+    # Read-modify-write instructions.
+
+    def modify(self, mode, fn):
+        if mode == "acc":
+            self.a = self.set_nz(fn(self.a))
+        else:
+            addr = self.address(mode, False)
+            self.memory[addr] = self.set_nz(fn(self.memory[addr]))
+
+    def op_asl(self, mode, penalty):
+        def fn(value):
+            self.c = value >> 7
+            return (value << 1) & 0xff
+        self.modify(mode, fn)
+
+    def op_lsr(self, mode, penalty):
+        def fn(value):
+            self.c = value & 1
+            return value >> 1
+        self.modify(mode, fn)
+
+    def op_rol(self, mode, penalty):
+        def fn(value):
+            result = ((value << 1) | self.c) & 0xff
+            self.c = value >> 7
+            return result
+        self.modify(mode, fn)
+
+    def op_ror(self, mode, penalty):
+        def fn(value):
+            result = (value >> 1) | (self.c << 7)
+            self.c = value & 1
+            return result
+        self.modify(mode, fn)
+
+    def op_inc(self, mode, penalty):
+        self.modify(mode, lambda value: (value + 1) & 0xff)
+
+    def op_dec(self, mode, penalty):
+        self.modify(mode, lambda value: (value - 1) & 0xff)
+
+    # Register instructions.
+
+    def op_inx(self, mode, penalty):
+        self.x = self.set_nz((self.x + 1) & 0xff)
+
+    def op_iny(self, mode, penalty):
+        self.y = self.set_nz((self.y + 1) & 0xff)
+
+    def op_dex(self, mode, penalty):
+        self.x = self.set_nz((self.x - 1) & 0xff)
+
+    def op_dey(self, mode, penalty):
+        self.y = self.set_nz((self.y - 1) & 0xff)
+
+    def op_tax(self, mode, penalty):
+        self.x = self.set_nz(self.a)
+
+    def op_tay(self, mode, penalty):
+        self.y = self.set_nz(self.a)
+
+    def op_txa(self, mode, penalty):
+        self.a = self.set_nz(self.x)
+
+    def op_tya(self, mode, penalty):
+        self.a = self.set_nz(self.y)
+
+    def op_tsx(self, mode, penalty):
+        self.x = self.set_nz(self.s)
+
+    def op_txs(self, mode, penalty):
+        self.s = self.x
+
+    # Flag instructions.
+
+    def op_clc(self, mode, penalty): self.c = 0
+    def op_sec(self, mode, penalty): self.c = 1
+    def op_cld(self, mode, penalty): self.d = 0
+    def op_sed(self, mode, penalty): self.d = 1
+    def op_cli(self, mode, penalty): self.i = 0
+    def op_sei(self, mode, penalty): self.i = 1
+    def op_clv(self, mode, penalty): self.v = 0
+
+    def op_nop(self, mode, penalty):
+        pass
+
+    # Stack instructions.
+
+    def op_pha(self, mode, penalty):
+        self.push(self.a)
+
+    def op_php(self, mode, penalty):
+        self.push(self.flags())
+
+    def op_pla(self, mode, penalty):
+        self.a = self.set_nz(self.pull())
+
+    def op_plp(self, mode, penalty):
+        self.set_flags(self.pull())
+
+    # Branches and jumps. The program counter is left pointing to the
+    # operand, which is skipped after each handler returns.
+
+    def branch(self, taken):
+        if taken:
+            offset = self.memory[self.pc]
+            if offset >= 128: offset -= 256
+            following = (self.pc + 1) & 0xffff
+            target = (following + offset) & 0xffff
+            self.cycles += 1
+            if (following ^ target) & 0xff00:
+                self.cycles += 1
+            self.pc = (target - 1) & 0xffff
+
+    def op_bcc(self, mode, penalty): self.branch(not self.c)
+    def op_bcs(self, mode, penalty): self.branch(self.c)
+    def op_bne(self, mode, penalty): self.branch(not self.z)
+    def op_beq(self, mode, penalty): self.branch(self.z)
+    def op_bpl(self, mode, penalty): self.branch(not self.n)
+    def op_bmi(self, mode, penalty): self.branch(self.n)
+    def op_bvc(self, mode, penalty): self.branch(not self.v)
+    def op_bvs(self, mode, penalty): self.branch(self.v)
+
+    def op_jmp(self, mode, penalty):
+        self.pc = (self.address(mode, False) - 2) & 0xffff
+
+    def op_jsr(self, mode, penalty):
+        # Push the address of the last byte of the instruction.
+        self.push_word((self.pc + 1) & 0xffff)
+        self.pc = (self.address(mode, False) - 2) & 0xffff
+
+    def op_rts(self, mode, penalty):
+        self.pc = (self.pull_word() + 1) & 0xffff
+
+    def op_rti(self, mode, penalty):
+        self.set_flags(self.pull())
+        self.pc = self.pull_word()
+
+    def op_brk(self, mode, penalty):
+        self.push_word((self.pc + 1) & 0xffff)
+        self.push(self.flags())
+        self.i = 1
+        self.pc = self.read_word(0xfffe)
+
+    # Helpers for traps.
+
+    def return_from_subroutine(self):
+        # Perform an rts, including its cycles, for a trap that replaces a
+        # subroutine.
+        self.pc = (self.pull_word() + 1) & 0xffff
+        self.cycles += 6
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+"""
+cycles.py - Measures the number of 6502 cycles used to run bytecode.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from assemble6502 import AssemblyError, assemble
+from cpu6502 import CPU, Stop
+from mkophis import write_opcodes
+import io, os, sys
+import translate
+
+arch_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+tools_dir = os.path.join(arch_dir, os.pardir, os.pardir, "tools")
+
+# The address of the registers and the clock speed of the target machines.
+stack_ptr = 0x80
+clock = 2000000
+# Returning to this address stops the emulator.
+stop_addr = 0xfff0
+
+def usage(args):
+    sys.stderr.write("usage: %s [-t] [-s] [-l <cycle limit>] "
+                     "[-d <data address> <data file>] <bytecode file>\n" % sys.argv[0])
+    sys.exit(1)
+
+def opcode_name(opcode):
+    n, high = opcode & 0x0f, opcode >> 4
+    if n == 9:
+        return {0: "not", 7: "b"}.get(high, "bx")
+    elif n == 15:
+        return "sys %i" % high
+    return translate.names[n]
+
+def oswrch(cpu):
+    cpu.output.append(chr(cpu.a))
+    cpu.return_from_subroutine()
+
+def stop(cpu):
+    raise Stop()
+
+def create_cpu(origin, image, entry, preloads):
+
+    # Return a CPU with the image and data loaded, ready to call the entry
+    # point as a subroutine.
+    cpu = CPU()
+    cpu.load(origin, image)
+    for addr, values in preloads:
+        cpu.load(addr, values)
+    cpu.output = []
+    cpu.traps[0xffee] = oswrch
+    cpu.traps[stop_addr] = stop
+    cpu.push_word(stop_addr - 1)
+    cpu.pc = entry
+    return cpu
+
+def run_interpreter(code, preloads=(), limit=None):
+
+    # Run the bytecode with the interpreter, returning the CPU and a
+    # dictionary mapping the names of opcodes to lists containing the number
+    # of times they were executed and the cycles used.
+
+    # Append a sys 0 (exit) call, as the simulator does.
+    f = io.StringIO()
+    write_opcodes(f, code + b"\x0f")
+    origin, image, symbols = assemble(os.path.join(arch_dir, "template.oph"),
+                                      {"code.oph": f.getvalue()})
+
+    cpu = create_cpu(origin, image, origin, preloads)
+    dispatch = symbols["exec_instruction"]
+    pc_addr = symbols["pc"]
+
+    costs = {}
+    current = "startup"
+    started = 0
+
+    while limit is None or cpu.cycles < limit:
+        if cpu.pc == dispatch:
+            # Charge the cycles since the last dispatch to the previous
+            # instruction.
+            costs.setdefault(current, [0, 0])
+            costs[current][0] += 1
+            costs[current][1] += cpu.cycles - started
+            started = cpu.cycles
+            current = opcode_name(cpu.memory[cpu.read_word(pc_addr)])
+        try:
+            cpu.step()
+        except Stop:
+            break
+    else:
+        raise ValueError("Cycle limit reached.")
+
+    costs.setdefault(current, [0, 0])
+    costs[current][0] += 1
+    costs[current][1] += cpu.cycles - started
+    return cpu, costs
+
+def run_translated(code, preloads=(), limit=None):
+
+    lines = translate.translate(code, translate.program_start, True)
+    origin, image, symbols = assemble(os.path.join(arch_dir, "translated.oph"),
+                                      {"translated.oph": "\n".join(lines)})
+    cpu = create_cpu(origin, image, origin, preloads)
+    if not cpu.run(limit):
+        raise ValueError("Cycle limit reached.")
+    return cpu
+
+def simulate(code, preloads):
+
+    # Return the registers produced by running the bytecode in the simulator.
+    sys.path.insert(0, tools_dir)
+    import simulator
+    simulator.load(code, translate.program_start, preloads)
+    simulator.engines["fast"]()
+    return simulator.stack[simulator.sp:simulator.sp + 16]
+
+def registers(cpu):
+    return list(cpu.memory[stack_ptr:stack_ptr + 16])
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    translated = "-t" in args
+    compare = "-s" in args
+    args = [arg for arg in args if arg not in ("-t", "-s")]
+
+    limit = 50000000
+    preloads = []
+    while "-l" in args or "-d" in args:
+        for option, count in ("-l", 1), ("-d", 2):
+            if option in args:
+                at = args.index(option)
+                values = args[at + 1:at + 1 + count]
+                if len(values) != count:
+                    usage(args)
+                if option == "-l":
+                    limit = int(values[0], 0)
+                else:
+                    preloads.append((int(values[0], 0), open(values[1], "rb").read()))
+                args = args[:at] + args[at + 1 + count:]
+
+    if len(args) != 2:
+        usage(args)
+
+    code = open(args[1], "rb").read()
+
+    try:
+        cpu, costs = run_interpreter(code, preloads, limit)
+    except (AssemblyError, ValueError) as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(1)
+
+    if cpu.output:
+        print("".join(cpu.output))
+
+    print("Opcode        Count       Cycles  Cycles/op")
+    total = startup = 0
+    for name, (count, cycles) in sorted(costs.items()):
+        if name == "startup":
+            startup = cycles
+            continue
+        total += count
+        print("%-8s %10i %12i %10.1f" % (name, count, cycles, cycles / count))
+
+    print("Interpreter: %i instructions in %i cycles (%.3f s at 2 MHz), "
+          "%i cycles to start" % (total, cpu.cycles, cpu.cycles / clock, startup))
+    print("Registers:", registers(cpu))
+
+    failed = False
+    if translated:
+        try:
+            native = run_translated(code, preloads, limit)
+        except (AssemblyError, ValueError) as e:
+            sys.stderr.write(str(e) + "\n")
+            sys.exit(1)
+
+        print("Translated: %i cycles (%.3f s at 2 MHz), %.1f times faster" % (
+              native.cycles, native.cycles / clock, cpu.cycles / native.cycles))
+        if registers(native) != registers(cpu):
+            print("Translated registers differ:", registers(native))
+            failed = True
+
+    if compare:
+        expected = simulate(code, preloads)
+        if expected != registers(cpu):
+            print("Simulator registers differ:", expected)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+    sys.exit()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+"""
+mkpacked.py - Packs 6502 code with a decompressor that unpacks it on start-up.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from assemble6502 import AssemblyError, assemble
+from cpu6502 import CPU
+from mkophis import write_opcodes
+import io, os, sys
+
+arch_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+tools_dir = os.path.join(arch_dir, os.pardir, os.pardir, "tools")
+sys.path.insert(0, os.path.join(tools_dir, "compression"))
+
+from compress import compress
+
+# The address that programs built with template.oph are loaded at.
+default_start = 0x0e02
+clock = 2000000
+# Tapes are read at 1200 baud, with a start and stop bit for each byte.
+tape_rate = 1200 / 10
+
+def usage(args):
+    sys.stderr.write("usage: %s [-b <offset bits>] [-a <start address>] "
+                     "<6502 code file> <oph file> [<packed code file>]\n" % sys.argv[0])
+    sys.exit(1)
+
+def packed_source(image, start, bits, compressed, name):
+
+    # Return a list of lines containing a program that unpacks the compressed
+    # image to the start address and runs it. It is placed after the end of
+    # the unpacked image so that the decompressor does not overwrite itself or
+    # the compressed data.
+    end = start + len(image)
+    lines = [
+        "; Packed from %s: %i bytes compressed to %i bytes with %i offset bits." % (
+            name, len(image), len(compressed), bits),
+        ".org $%04x" % end,
+        "",
+        ".alias unpacked_start $%04x" % start,
+        ".alias unpacked_end $%04x" % end,
+        ".alias dest $76",
+        ".alias first $77",
+        ".alias second $78",
+        ".alias extra $79",
+        "",
+        ".include \"decompress.oph\"",
+        "",
+        "unpack:",
+        "    lda #<packed_data",
+        "    sta src_ptr",
+        "    lda #>packed_data",
+        "    sta src_ptr_high",
+        "    lda #<unpacked_start",
+        "    sta dest_ptr",
+        "    lda #>unpacked_start",
+        "    sta dest_ptr_high",
+        "    lda #<unpacked_end",
+        "    sta length",
+        "    lda #>unpacked_end",
+        "    sta length_high",
+        "    lda #%i" % bits,
+        "    sta decompress_bits",
+        "    jsr decompress",
+        "    jmp unpacked_start",
+        "",
+        "packed_data:"
+        ]
+
+    f = io.StringIO()
+    write_opcodes(f, compressed)
+    lines += f.getvalue().splitlines()
+    return lines
+
+def tape_time(size, name):
+
+    # Return the time taken to load a file of the given size from tape,
+    # counting the bytes in each block and its header but not the carrier
+    # tone between blocks. Each header contains a synchronisation byte, the
+    # name and its terminator, 17 bytes of addresses and flags and a CRC.
+    # Each block of data is followed by a CRC.
+    blocks = max(1, (size + 255) // 256)
+    header = 1 + min(len(name), 10) + 1 + 17 + 2
+    return (size + blocks * (header + 2)) / tape_rate
+
+def unpack(origin, packed, exec_addr, start, image):
+
+    # Run the packed program until it jumps to the unpacked program, checking
+    # that the image was unpacked correctly, and return the cycles used.
+    cpu = CPU()
+    cpu.load(origin, packed)
+    cpu.pc = exec_addr
+    limit = 100 * clock
+
+    while cpu.pc != start:
+        cpu.step()
+        if cpu.cycles > limit:
+            raise ValueError("The packed program did not finish unpacking.")
+
+    if bytes(cpu.memory[start:start + len(image)]) != image:
+        raise ValueError("The packed program did not unpack the image correctly.")
+
+    return cpu.cycles
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    bits = None
+    start = default_start
+
+    while "-b" in args or "-a" in args:
+        for option in "-b", "-a":
+            if option in args:
+                at = args.index(option)
+                if at + 1 == len(args):
+                    usage(args)
+                value = int(args[at + 1], 0)
+                if option == "-b":
+                    bits = value
+                else:
+                    start = value
+                args = args[:at] + args[at + 2:]
+
+    if len(args) not in (3, 4):
+        usage(args)
+
+    image = open(args[1], "rb").read()
+    if not image:
+        sys.stderr.write("The 6502 code file is empty.\n")
+        sys.exit(1)
+
+    # Use the number of offset bits that gives the smallest output unless one
+    # was given.
+    choices = [bits] if bits else range(2, 6)
+    compressed, bits = min(((compress(image, b), b) for b in choices),
+                           key=lambda item: len(item[0]))
+
+    lines = packed_source(image, start, bits, compressed, os.path.basename(args[1]))
+    f = open(args[2], "w")
+    f.write("\n".join(lines) + "\n")
+    f.close()
+
+    # Assemble the packed program in the directory containing decompress.oph
+    # and run it to find the time taken to unpack the image.
+    source = os.path.join(arch_dir, os.path.basename(args[2]))
+    try:
+        origin, packed, symbols = assemble(source, {os.path.basename(args[2]): "\n".join(lines)})
+        cycles = unpack(origin, packed, symbols["unpack"], start, image)
+    except (AssemblyError, ValueError) as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(1)
+
+    if len(args) == 4:
+        open(args[3], "wb").write(packed)
+
+    # Both files are loaded with the same name.
+    name = os.path.basename(args[-1])
+
+    unpacked_time = tape_time(len(image), name)
+    packed_time = tape_time(len(packed), name)
+    unpack_time = cycles / clock
+    saving = unpacked_time - packed_time - unpack_time
+
+    print("Unpacked: %6i bytes at $%04x-$%04x, %6.1f s to load" % (
+          len(image), start, start + len(image) - 1, unpacked_time))
+    print("Packed:   %6i bytes at $%04x-$%04x, %6.1f s to load (%i offset bits)" % (
+          len(packed), origin, origin + len(packed) - 1, packed_time, bits))
+    print("Unpacking: %i cycles (%.3f s at 2 MHz)" % (cycles, unpack_time))
+    print("Saving: %.1f s (%.0f%% of the unpacked load time)" % (
+          saving, 100 * saving / unpacked_time))
+    print("Load address %x, execution address %x" % (origin, symbols["unpack"]))
+
+    sys.exit()
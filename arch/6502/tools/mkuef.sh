@@ -2,12 +2,19 @@
 
 set -e
 
-if [[ $# != 2 ]]; then
-    echo "usage: mkuef.py <6502 code file> <UEF file>"
+if [[ $# != 2 && $# != 4 ]]; then
+    echo "usage: mkuef.py <6502 code file> <UEF file> [<load address> <execution address>]"
     exit 1
 fi
 
-echo -n '$.'`basename "$1"`' E02 E02 ' > "$1".inf
+LOAD=E02
+EXEC=E02
+if [[ $# == 4 ]]; then
+    LOAD=$3
+    EXEC=$4
+fi
+
+echo -n '$.'`basename "$1"`" $LOAD $EXEC " > "$1".inf
 printf "%x\n" `stat --printf="%s" $1` >> "$1".inf
 
 UEFtrans.py "$2" new Electron 0
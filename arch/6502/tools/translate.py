@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+
+"""
+translate.py - Translates bytecode to 6502 code in Ophis assembler statements.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from mkophis import write_opcodes
+import sys
+
+# The address that bytecode is loaded at in the template used with the
+# interpreter, which is also used for the bytecode image here.
+program_start = 0x0e05
+
+def usage(args):
+    sys.stderr.write("usage: %s [-i] [-b <base address>] <bytecode file> <oph file>\n" % sys.argv[0])
+    sys.exit(1)
+
+names = ["lc", "cpy", "add", "sub", "and", "or", "xor", "ld", "st", "bx",
+         "adc", "sbc", "js", "jss", "ret", "sys"]
+
+def decode(code, base, addr):
+
+    # Return the name, length and operands of the instruction at the address,
+    # with branch and call targets as absolute addresses.
+    i = addr - base
+    opcode = code[i]
+    n, high = opcode & 0x0f, opcode >> 4
+    name = names[n]
+
+    def byte(j):
+        if i + j >= len(code):
+            raise ValueError("Truncated instruction at 0x%04x." % addr)
+        return code[i + j]
+
+    def signed(v):
+        return v - 256 if v >= 128 else v
+
+    if n == 0:
+        return name, 2, (high, byte(1))
+    elif n <= 8:
+        args = byte(1)
+        return name, 2, (high, args & 0x0f, args >> 4)
+    elif n == 9:
+        if high == 0:
+            args = byte(1)
+            return "not", 2, (args & 0x0f, args >> 4)
+        elif high == 7:
+            return "b", 2, (addr + signed(byte(1)),)
+        else:
+            args = byte(2)
+            return name, 3, (high, args & 0x0f, args >> 4, addr + signed(byte(1)))
+    elif n == 12:
+        return name, 3, (high, byte(1) | (byte(2) << 8))
+    elif n == 13:
+        return name, 2, (high, addr + signed(byte(1)))
+    else:
+        return name, 1, (high,)
+
+def successors(name, length, operands, addr):
+
+    # Return the addresses that execution can continue at after the
+    # instruction, followed by the addresses of any subroutines it calls.
+    following = addr + length
+    if name == "b":
+        return [operands[0]], []
+    elif name == "bx":
+        return [following, operands[3]], []
+    elif name in ("js", "jss"):
+        return [following], [operands[1]]
+    elif name == "ret" or (name == "sys" and operands[0] == 0):
+        return [], []
+    else:
+        return [following], []
+
+def find_blocks(code, base):
+
+    # Build the control flow graph of the code reachable from the start of the
+    # bytecode, returning a dictionary mapping the addresses of the first
+    # instruction in each basic block to lists of (address, name, length,
+    # operands) tuples, and the set of subroutine addresses.
+    end = base + len(code)
+    instructions = {}
+    leaders = set([base])
+    subroutines = set()
+    pending = [base]
+
+    while pending:
+        addr = pending.pop()
+        if addr in instructions or addr == end:
+            continue
+        if not base <= addr < end:
+            raise ValueError("Jump to 0x%04x outside the program." % addr)
+
+        name, length, operands = decode(code, base, addr)
+        instructions[addr] = (name, length, operands)
+        following, called = successors(name, length, operands, addr)
+
+        for target in called:
+            leaders.add(target)
+            subroutines.add(target)
+        if name in ("b", "bx"):
+            leaders.update(following)
+        pending += following + called
+
+    # Split the instructions into blocks at each leader and after each
+    # instruction that transfers control.
+    blocks = {}
+    block = None
+    following = None
+    for addr in sorted(instructions):
+        name, length, operands = instructions[addr]
+        if block is None or addr in leaders or addr != following:
+            block = blocks.setdefault(addr, [])
+        block.append((addr, name, length, operands))
+        following = addr + length
+        if name in ("b", "bx", "ret") or (name == "sys" and operands[0] == 0):
+            block = None
+
+    return blocks, subroutines
+
+def label(addr):
+    return "a_%04x" % addr
+
+# Instructions that read and write the carry/borrow flag.
+reads_cb = set(["adc", "sbc"])
+writes_cb = set(["add", "sub"])
+
+def cb_needed(block, i):
+
+    # Return whether the carry/borrow flag written by the instruction at index
+    # i of the block may be read before it is overwritten. Assume that it is
+    # read if the end of the block or a call is reached, since the subroutine
+    # called may read it.
+    for addr, name, length, operands in block[i + 1:]:
+        if name in reads_cb or name in ("js", "jss"):
+            return True
+        elif name in writes_cb or (name == "sys" and operands[0] == 4):
+            return False
+    return True
+
+# Inverted conditions for branches, used to skip over a jmp to the target.
+# The less than or equal condition needs two branches.
+skip_branches = {
+    1: ["bcs"],             # blt
+    2: ["bne"],             # beq
+    4: ["bcc", "beq"],      # bgt
+    5: ["beq"],             # bne
+    6: ["bcc"]              # bge
+    }
+
+def translate_instruction(block, i):
+
+    # Return a list of lines of 6502 code for the instruction at index i of
+    # the block. Register n is found at address n,x in zero page, where X holds
+    # the low byte of sp.
+    addr, name, length, operands = block[i]
+    lines = []
+    emit = lines.append
+
+    if name == "lc":
+        dest, value = operands
+        emit("lda #%i" % value)
+        emit("sta %i,x" % dest)
+
+    elif name == "cpy":
+        dest, src, shift = operands
+        emit("lda %i,x" % src)
+        if shift >= 8:
+            lines += ["asl"] * (16 - shift)
+        else:
+            lines += ["lsr"] * shift
+        emit("sta %i,x" % dest)
+
+    elif name in ("add", "sub"):
+        dest, first, second = operands
+        if name == "add":
+            lines += ["clc", "lda %i,x" % first, "adc %i,x" % second]
+        else:
+            lines += ["sec", "lda %i,x" % first, "sbc %i,x" % second]
+        emit("sta %i,x" % dest)
+        if cb_needed(block, i):
+            # The carry is set for a carry from add and clear for a borrow
+            # from sub.
+            lines += ["lda #0", "rol"]
+            if name == "sub":
+                emit("eor #1")
+            emit("sta cb")
+
+    elif name in ("and", "or", "xor"):
+        dest, first, second = operands
+        op = {"and": "and", "or": "ora", "xor": "eor"}[name]
+        lines += ["lda %i,x" % first, "%s %i,x" % (op, second), "sta %i,x" % dest]
+
+    elif name == "not":
+        dest, src = operands
+        lines += ["lda %i,x" % src, "eor #255", "sta %i,x" % dest]
+
+    elif name in ("ld", "st"):
+        reg, low, high = operands
+        lines += ["lda %i,x" % low, "sta first", "lda %i,x" % high, "sta second",
+                  "ldy #0"]
+        if name == "ld":
+            lines += ["lda (first),y", "sta %i,x" % reg]
+        else:
+            lines += ["lda %i,x" % reg, "sta (first),y"]
+
+    elif name == "adc":
+        # Increment the register if cb is set, leaving cb set only if the
+        # register wraps round to zero.
+        skip = "%s_skip" % label(addr)
+        lines += ["lda cb", "beq " + skip, "inc %i,x" % operands[0],
+                  "beq " + skip, "lda #0", "sta cb", skip + ":"]
+
+    elif name == "sbc":
+        # Decrement the register if cb is set, leaving cb set only if the
+        # register was zero.
+        skip = "%s_skip" % label(addr)
+        lines += ["lda cb", "beq " + skip, "lda %i,x" % operands[0],
+                  "dec %i,x" % operands[0], "cmp #0", "beq " + skip,
+                  "lda #0", "sta cb", skip + ":"]
+
+    elif name == "b":
+        emit("jmp " + label(operands[0]))
+
+    elif name == "bx":
+        cond, first, second, target = operands
+        lines += ["lda %i,x" % first, "cmp %i,x" % second]
+        skip = "%s_skip" % label(addr)
+        if cond == 3:
+            # ble: branch if less than (C clear) or equal (Z set).
+            take = "%s_take" % label(addr)
+            lines += ["bcc " + take, "bne " + skip, take + ":"]
+        else:
+            lines += ["%s %s" % (branch, skip) for branch in skip_branches[cond]]
+        lines += ["jmp " + label(target), skip + ":"]
+
+    elif name in ("js", "jss"):
+        # Reserve space for the subroutine's registers, then call it using the
+        # processor stack for the return address.
+        args, target = operands
+        if args:
+            lines += ["txa", "sec", "sbc #%i" % args, "tax", "stx sp"]
+        emit("jsr " + label(target))
+
+    elif name == "ret":
+        args = operands[0]
+        if args:
+            lines += ["txa", "clc", "adc #%i" % args, "tax", "stx sp"]
+        emit("rts")
+
+    elif name == "sys":
+        n = operands[0]
+        if n == 0:
+            emit("jmp exit")
+        elif n == 1:
+            lines += ["lda 0,x", "jsr $ffee"]
+        elif n in system_routines:
+            lines += ["jsr " + system_routines[n], "ldx sp"]
+
+    return lines
+
+system_routines = {2: "sys_copy", 3: "sys_fill", 4: "sys_compare",
+                   5: "sys_decompress"}
+
+def translate(code, base, include_image=False):
+
+    # Return a list of lines containing a complete program in Ophis syntax.
+    blocks, subroutines = find_blocks(code, base)
+
+    lines = [
+        "; Translated from bytecode at 0x%04x." % base,
+        ".org $0e02",
+        "",
+        ".alias stack_ptr $0080",
+        ".alias sp $72",
+        ".alias sp_high $73",
+        ".alias cb $75",
+        ".alias dest $76",
+        ".alias first $77",
+        ".alias second $78",
+        ".alias extra $79",
+        "",
+        "main:",
+        "    jmp start",
+        "",
+        ]
+
+    if include_image:
+        if base != program_start:
+            raise ValueError("The bytecode must be assembled with a base "
+                             "address of 0x%04x to include it." % program_start)
+        lines.append("program_start:")
+        f = Lines()
+        write_opcodes(f, code)
+        lines += f.lines
+        lines.append("")
+
+    lines += [
+        "start:",
+        "    lda #0",
+        "    sta cb",
+        "    lda #<stack_ptr",
+        "    sta sp",
+        "    lda #>stack_ptr",
+        "    sta sp_high",
+        "    tsx",
+        "    stx exit_stack",
+        "    ldx sp",
+        ""
+        ]
+
+    for addr in sorted(blocks):
+        block = blocks[addr]
+        if addr in subroutines:
+            lines.append("; Subroutine")
+        lines.append(label(addr) + ":")
+        for i in range(len(block)):
+            for line in translate_instruction(block, i):
+                if line.endswith(":"):
+                    lines.append(line)
+                else:
+                    lines.append("    " + line)
+
+        # Execution continues after the last instruction unless it transfers
+        # control. If the next instruction was not translated then it is the
+        # end of the program.
+        last_addr, name, length, operands = block[-1]
+        following = last_addr + length
+        if following not in blocks and name not in ("b", "ret") and \
+           not (name == "sys" and operands[0] == 0):
+            lines.append("    jmp exit")
+        lines.append("")
+
+    # Branches to the end of the program exit from it.
+    lines += [
+        label(base + len(code)) + ":",
+        "exit:",
+        "    ldx exit_stack",
+        "    txs",
+        "    rts",
+        "",
+        "exit_stack: .byte 0",
+        "",
+        '.include "system.oph"'
+        ]
+
+    return lines
+
+class Lines:
+
+    # Collects the lines written by write_opcodes.
+    def __init__(self):
+        self.lines = []
+    def write(self, text):
+        self.lines += text.splitlines()
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    include_image = "-i" in args
+    if include_image:
+        args.remove("-i")
+
+    base = program_start
+    if "-b" in args:
+        at = args.index("-b")
+        if at + 1 == len(args):
+            usage(args)
+        base = int(args[at + 1], 0)
+        args = args[:at] + args[at + 2:]
+
+    if len(args) != 3:
+        usage(args)
+
+    code = open(args[1], "rb").read()
+    try:
+        lines = translate(code, base, include_image)
+    except ValueError as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(1)
+
+    f = open(args[2], "w")
+    f.write("\n".join(lines) + "\n")
+    f.close()
+
+    sys.exit()
@@ -0,0 +1,181 @@
+"""
+accesses.py - Records the memory accesses made by programs in the simulator.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections, json
+
+page_size = 256
+# Accessed addresses closer together than this are treated as parts of the
+# same buffer.
+buffer_gap = 4
+# Buffers up to this size are suggested for zero page. The 6502 virtual
+# machine leaves little of zero page free, so only small buffers fit.
+zero_page_size = 32
+
+class Site:
+
+    # The accesses made by a ld or st instruction.
+    def __init__(self, pc, kind):
+        self.pc = pc
+        self.kind = kind
+        self.count = 0
+        self.addresses = set()
+        self.last = None
+        self.strides = collections.Counter()
+
+    def access(self, addr):
+        self.count += 1
+        self.addresses.add(addr)
+        if self.last is not None:
+            self.strides[addr - self.last] += 1
+        self.last = addr
+
+    def stride(self):
+
+        # Return the most common stride and the fraction of accesses that used
+        # it, or None if the site was only used once.
+        if not self.strides:
+            return None, 0
+        stride, count = self.strides.most_common(1)[0]
+        return stride, count / (self.count - 1)
+
+class Recorder:
+
+    # Records the loads and stores made while it is registered with the
+    # simulator.
+    def __init__(self):
+        self.reads = collections.Counter()
+        self.writes = collections.Counter()
+        self.sites = {}
+
+    def register(self, simulator):
+        simulator.add_hook("load", self.load)
+        simulator.add_hook("store", self.store)
+
+    def unregister(self, simulator):
+        simulator.remove_hook("load", self.load)
+        simulator.remove_hook("store", self.store)
+
+    def load(self, pc, addr, value):
+        self.reads[addr] += 1
+        self.site(pc, "ld").access(addr)
+
+    def store(self, pc, addr, value):
+        self.writes[addr] += 1
+        self.site(pc, "st").access(addr)
+
+    def site(self, pc, kind):
+        site = self.sites.get(pc)
+        if site is None:
+            site = self.sites[pc] = Site(pc, kind)
+        return site
+
+    def pages(self):
+
+        # Return a list of (page, reads, writes) tuples in address order.
+        reads = collections.Counter()
+        writes = collections.Counter()
+        for addr, count in self.reads.items():
+            reads[addr // page_size] += count
+        for addr, count in self.writes.items():
+            writes[addr // page_size] += count
+        return [(page, reads[page], writes[page])
+                for page in sorted(set(reads) | set(writes))]
+
+    def buffers(self):
+
+        # Group the accessed addresses into buffers, returning a list of
+        # (start, end, reads, writes) tuples, where end is the address after
+        # the last one accessed, ranked by the number of accesses per byte.
+        buffers = []
+        current = None
+        for addr in sorted(set(self.reads) | set(self.writes)):
+            if current is None or addr - current[1] >= buffer_gap:
+                current = [addr, addr + 1, 0, 0]
+                buffers.append(current)
+            current[1] = addr + 1
+            current[2] += self.reads[addr]
+            current[3] += self.writes[addr]
+
+        buffers.sort(key=lambda b: (-(b[2] + b[3]) / (b[1] - b[0]), b[0]))
+        return [tuple(b) for b in buffers]
+
+def suggestion(start, end):
+
+    size = end - start
+    if end <= page_size:
+        return "in zero page"
+    elif size <= zero_page_size:
+        return "zero page"
+    elif size <= page_size and start // page_size != (end - 1) // page_size:
+        # Indexed accesses that cross a page boundary take an extra cycle.
+        return "align to page"
+    return "-"
+
+def write_report(f, recorder, symbols=None):
+
+    total_reads = sum(recorder.reads.values())
+    total_writes = sum(recorder.writes.values())
+    f.write("%i loads and %i stores to %i addresses in %i pages\n\n" % (
+            total_reads, total_writes,
+            len(set(recorder.reads) | set(recorder.writes)),
+            len(recorder.pages())))
+
+    f.write("Buffer         Size    Reads   Writes  Per byte  Suggestion\n")
+    for start, end, reads, writes in recorder.buffers():
+        f.write("%04x-%04x %9i %8i %8i %9.1f  %s\n" % (
+                start, end - 1, end - start, reads, writes,
+                (reads + writes) / (end - start), suggestion(start, end)))
+
+    f.write("\nPage    Reads   Writes\n")
+    for page, reads, writes in recorder.pages():
+        f.write("%02x %10i %8i\n" % (page, reads, writes))
+
+    f.write("\nSite  Kind     Count  Addresses  Stride  Regular  Location\n")
+    for pc in sorted(recorder.sites):
+        site = recorder.sites[pc]
+        stride, fraction = site.stride()
+        location = symbols.describe(pc) if symbols else ""
+        f.write("%04x  %-4s %9i %10i  %6s %7.0f%%  %s\n" % (
+                pc, site.kind, site.count, len(site.addresses),
+                "-" if stride is None else stride, fraction * 100,
+                location))
+
+def write_json(path, recorder):
+
+    sites = []
+    for pc in sorted(recorder.sites):
+        site = recorder.sites[pc]
+        sites.append({"pc": pc, "kind": site.kind, "count": site.count,
+                      "addresses": len(site.addresses),
+                      "strides": sorted(site.strides.items())})
+
+    addresses = sorted(set(recorder.reads) | set(recorder.writes))
+    result = {
+        "addresses": [[addr, recorder.reads[addr], recorder.writes[addr]]
+                      for addr in addresses],
+        "pages": recorder.pages(),
+        "sites": sites,
+        "buffers": [{"start": start, "end": end, "reads": reads,
+                     "writes": writes, "suggestion": suggestion(start, end)}
+                    for start, end, reads, writes in recorder.buffers()]
+        }
+
+    f = open(path, "w")
+    json.dump(result, f)
+    f.close()
@@ -21,15 +21,15 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from common import get_int, opt
-import pretty
-import struct, sys
+from symbols import write_map
+import io, os, struct, sys
 
 def error(msg, l):
     sys.stderr.write(msg + " on line %i\n" % l)
     sys.exit(1)
 
 def usage(args):
-    sys.stderr.write("usage: %s [-c] [-v] [-b <base address>] <input file> <output file>\n" % sys.argv[0])
+    sys.stderr.write("usage: %s [-c] [-v] [-b <base address>] [-m <map file>] <input file> <output file>\n" % sys.argv[0])
     sys.exit(1)
 
 def remove_comments(line):
@@ -48,14 +48,27 @@ def split_pair(line, c, l):
     left, right = pieces
     return left.strip(), right.strip()
 
-def define_label(label, value):
+def get_value(s, l):
+    try:
+        return get_int(s)
+    except ValueError:
+        error("invalid value '%s'" % s, l)
+
+def define_label(label, value, l):
 
     value, nparams = split_pair(value, ",", l)
-    np = get_int(nparams)
-    labels[label] = (get_int(value), np, True)
+    np = get_value(nparams, l)
+    labels[label] = (get_value(value, l), np, True)
 
 labels = {}
 registers = {}
+# Addresses of instructions and the lines that define them.
+line_table = []
+base_addr = 0
+# The directory that files included with .incbin are found in, and the
+# contents of files already included, indexed by path and compression.
+include_dir = ""
+included = {}
 
 def process(lines, out_f, verbose):
 
@@ -88,12 +101,12 @@ def process(lines, out_f, verbose):
                 # Allow label and register assignments
                 label, value = split_pair(line, "=", l)
                 if "," in value:
-                    define_label(label, value)
+                    define_label(label, value, l)
                 else:
                     if value.lower().startswith("r"):
                         registers[label] = value
                     else:
-                        labels[label] = (get_int(value), 0, True)
+                        labels[label] = (get_value(value, l), 0, True)
 
                 l += 1
                 continue
@@ -106,6 +119,22 @@ def process(lines, out_f, verbose):
             else:
                 name = name[0]
 
+            if name.startswith("."):
+                # Directives return the data they emit in both scans so that
+                # addresses are known in the first scan.
+                try:
+                    directive = directives[name.lower()]
+                except KeyError:
+                    error("unknown directive '%s'" % name, l)
+
+                values = directive(args, addr, l, scan)
+                if scan == 1:
+                    if verbose: print(Int(addr) + ":", Ins(name), args, len(values))
+                    out_f.write(values)
+                addr += len(values)
+                l += 1
+                continue
+
             try:
                 n, fmt, size, inst = instructions[name]
             except KeyError:
@@ -114,9 +143,17 @@ def process(lines, out_f, verbose):
             if scan == 0:
                 addr += size
             else:
+                line_table.append((addr, l))
                 addr += inst(n, fmt, l, name, args, addr, current_label, out_f, verbose)
             l += 1
 
+def find_label(label, l):
+
+    try:
+        return labels[label]
+    except KeyError:
+        error("unknown label '%s'" % label, l)
+
 def check_args(args, fmt, l):
 
     opt = 0
@@ -130,6 +167,11 @@ def check_args(args, fmt, l):
 
     for a, p in zip(args, fmt):
         p.rstrip("?")
+        if p[0] == "B" and a[:1] in ("<", ">"):
+            # The low or high byte of the address of a label.
+            target, nparams, absolute = find_label(a[1:], l)
+            a = str(target & 0xff if a[0] == "<" else target >> 8)
+
         if p[0] == "R":
             # Registers are specified as decimals with an optional leading R or r.
             a = a.lstrip("Rr")
@@ -211,6 +253,12 @@ def inst_1r(n, fmt, l, name, args, addr, current_label, out_f, verbose):
     if verbose: print(Int(addr) + ":", Ins(name), args, values)
     return 1
 
+def inst_sys(n, fmt, l, name, args, addr, current_label, out_f, verbose):
+
+    # Allow system calls to be specified by name.
+    args = [str(sys_values.get(a.lower(), a)) for a in args]
+    return inst_1r(n, fmt, l, name, args, addr, current_label, out_f, verbose)
+
 def inst_ret(n, fmt, l, name, args, addr, current_label, out_f, verbose):
 
     values = check_args(args, fmt, l)
@@ -229,7 +277,7 @@ def inst_bx(n, fmt, l, name, args, addr, current_label, out_f, verbose):
     cond = cond_values[name.lower()]
     # Obtain the target address, discarding the number of parameters for
     # regular labels.
-    target, nparams, absolute = labels[args[2]]
+    target, nparams, absolute = find_label(args[2], l)
     offset = target - addr
     if not -128 <= offset < 128: error("branch offset out of range", l)
 
@@ -248,7 +296,7 @@ def inst_b(n, fmt, l, name, args, addr, current_label, out_f, verbose):
 
     # Obtain the target address, discarding the number of parameters for
     # regular labels.
-    target, nparams, absolute = labels[args[0]]
+    target, nparams, absolute = find_label(args[0], l)
     offset = target - addr
     if not -128 <= offset < 128: error("branch offset out of range", l)
 
@@ -263,7 +311,7 @@ def inst_js(n, fmt, l, name, args, addr, current_label, out_f, verbose):
     values = check_args(args, fmt, l)
     # Resolve the label to an index in the instruction output and add it to the
     # base address.
-    target, nparams, absolute = labels[args[0]]
+    target, nparams, absolute = find_label(args[0], l)
     values.append(target)
 
     if verbose: print(Int(addr) + ":", Ins(name), nparams, args, values)
@@ -276,7 +324,7 @@ def inst_jss(n, fmt, l, name, args, addr, current_label, out_f, verbose):
     values = check_args(args, fmt, l)
     # Resolve the label to an index in the instruction output and add it to the
     # base address.
-    target, nparams, absolute = labels[args[0]]
+    target, nparams, absolute = find_label(args[0], l)
     offset = target - addr
     if offset < -128 or offset > 127: error("short jump out of range", l)
     values.append(offset)
@@ -286,10 +334,96 @@ def inst_jss(n, fmt, l, name, args, addr, current_label, out_f, verbose):
     out_f.write(struct.pack("<BB", n | (nparams << 4), values[0] & 0xff))
     return 2
 
+def get_data_value(a, lower, upper, l):
+
+    v = get_value(a, l)
+    if not lower <= v < upper:
+        error("value (%s) out of range" % repr(a), l)
+    return v % upper
+
+def dir_byte(args, addr, l, scan):
+
+    # Emit each value as a byte, packing them in a single operation.
+    if not args: error("no values given", l)
+    return bytes([get_data_value(a, -128, 0x100, l) for a in args])
+
+def dir_word(args, addr, l, scan):
+
+    # Emit each value or label address as a little-endian 16-bit word.
+    if not args: error("no values given", l)
+    values = []
+    for a in args:
+        if a[:1].isdigit() or a[:1] == "-":
+            values.append(get_data_value(a, -0x8000, 0x10000, l))
+        elif scan == 1:
+            values.append(find_label(a, l)[0])
+        else:
+            # Labels may not be defined until the second scan.
+            values.append(0)
+    return struct.pack("<%iH" % len(values), *values)
+
+def dir_fill(args, addr, l, scan):
+
+    # Emit the given number of copies of a byte value, which is zero if not
+    # specified.
+    if not 1 <= len(args) <= 2: error("invalid number of arguments", l)
+    count = get_data_value(args[0], 0, 0x10000, l)
+    value = get_data_value(args[1], -128, 0x100, l) if len(args) == 2 else 0
+    return bytes([value]) * count
+
+def dir_align(args, addr, l, scan):
+
+    # Emit zeros until the address is a multiple of the given value.
+    if len(args) != 1: error("invalid number of arguments", l)
+    alignment = get_data_value(args[0], 1, 0x10000, l)
+    return bytes(-addr % alignment)
+
+def dir_incbin(args, addr, l, scan):
+
+    # Emit the contents of a file, optionally compressed with the given
+    # number of offset bits (4 by default) for use with the decompress system
+    # call.
+    if not args or len(args) > 3 or (len(args) > 1 and args[1] != "compressed"):
+        error("expected a file name and optional compression settings", l)
+
+    path = os.path.join(include_dir, args[0].strip('"'))
+    bits = get_data_value(args[2], 1, 8, l) if len(args) == 3 else 4
+    key = (path, len(args) > 1, bits)
+
+    if key not in included:
+        try:
+            values = open(path, "rb").read()
+        except IOError:
+            error("cannot read file '%s'" % path, l)
+        if len(args) > 1:
+            from compression.compress import compress
+            values = compress(values, bits)
+        included[key] = values
+
+    return included[key]
+
+directives = {
+    ".byte": dir_byte,
+    ".word": dir_word,
+    ".fill": dir_fill,
+    ".align": dir_align,
+    ".incbin": dir_incbin
+    }
+
 value_limits = {
     "A": (0, 0x10000), "B": (-128, 256), "H": (0, 16), "R": (0, 16), "S": (-7, 16)
     }
 
+sys_values = {
+    "exit": 0,
+    "putc": 1,
+    "copy": 2,
+    "fill": 3,
+    "compare": 4,
+    "decompress": 5,
+    "dump": 15
+    }
+
 cond_values = {
     "blt": 0b001,
     "beq": 0b010,
@@ -326,9 +460,27 @@ instructions = {
     "js": (12, ["Llabel"], 3, inst_js),
     "jss": (13, ["Llabel"], 2, inst_jss),
     "ret": (14, [], 1, inst_ret),
-    "sys": (15, ["Hvalue"], 1, inst_1r)
+    "sys": (15, ["Hvalue"], 1, inst_sys)
     }
 
+def assemble(lines, base=0, verbose=False, directory=""):
+
+    # Assemble the lines of a program in memory, returning the encoded
+    # instructions and data. Files included with .incbin are found relative to
+    # the given directory.
+    global base_addr, include_dir
+
+    base_addr = base
+    include_dir = directory
+    labels.clear()
+    registers.clear()
+    line_table[:] = []
+    included.clear()
+
+    out_f = io.BytesIO()
+    process(lines, out_f, verbose)
+    return out_f.getvalue()
+
 if __name__ == "__main__":
 
     args = sys.argv[:]
@@ -336,8 +488,10 @@ if __name__ == "__main__":
     colour = opt(args, "-c")
     base, base_v = opt(args, "-b", 1, ["0"])
     base_addr = get_int(base_v)
+    map_file, map_path = opt(args, "-m", 1, [""])
 
     if colour:
+        import pretty
         Ins, Int, Label, Str = pretty.Ins, pretty.Int, pretty.Label, pretty.Str
     else:
         Ins = Int = Label = Str = lambda x: str(x)
@@ -347,6 +501,12 @@ if __name__ == "__main__":
 
     lines = open(args[1]).readlines()
     out_f = open(args[2], "wb")
+    out_f.write(assemble(lines, base_addr, verbose, os.path.dirname(args[1])))
+    out_f.close()
+
+    if map_file:
+        f = open(map_path, "w")
+        write_map(f, args[1], labels, line_table)
+        f.close()
 
-    process(lines, out_f, verbose)
     sys.exit()
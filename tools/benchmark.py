@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+
+"""
+benchmark.py - Measures the performance of the simulator's engines.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from common import get_int, opt
+from runtests import data_dir, find_tests, programs_dir, read_data, read_spec
+import contextlib, io, os, pickle, random, re, subprocess, sys, tempfile, time
+
+def usage(args):
+    sys.stderr.write("usage: %s [-e <engine>[,<engine>...]] [-n <decompressed size>] "
+                     "[-r <repeats>] [-s] [<workload>...]\n" % sys.argv[0])
+    sys.exit(1)
+
+# Synthetic workloads. Each is a source program with a list of (address, bytes)
+# pairs to load into memory before it is run.
+
+copy_source = """\
+; Copy %(length)i bytes from 0x4000 to 0x8000.
+lc r0 0x00              ; source
+lc r1 0x40
+lc r2 0x00              ; destination
+lc r3 0x80
+lc r4 %(low)i            ; length
+lc r5 %(high)i
+lc r6 0
+lc r7 1
+
+copy_loop:
+    ld r8 r0 r1
+    st r8 r2 r3
+    add r0 r0 r7
+    adc r1
+    add r2 r2 r7
+    adc r3
+    sub r4 r4 r7
+    sbc r5
+    bne r4 r6 copy_loop
+    bne r5 r6 copy_loop
+
+sys 0
+"""
+
+recursion_source = """\
+; Call a recursive subroutine %(count)i times, nesting calls as deeply as the
+; return address stack allows.
+lc r0 7                 ; depth
+lc r1 %(low)i            ; count
+lc r2 %(high)i
+lc r3 0
+lc r4 1
+
+call_loop:
+    js recurse
+    sub r1 r1 r4
+    sbc r2
+    bne r1 r3 call_loop
+    bne r2 r3 call_loop
+
+sys 0
+
+; Each call shifts the registers by one, so the caller's r0 is the depth.
+recurse: 1
+    lc r0 0
+    beq r1 r0 recurse_done
+    lc r0 1
+    sub r0 r1 r0        ; pass depth - 1 to the next call
+    js recurse
+    recurse_done:
+    ret
+"""
+
+pure_calls_source = """\
+; Call a subroutine that multiplies small numbers by values in a table
+; %(count)i times, so that most calls repeat earlier ones.
+lc r0 0                 ; total
+lc r1 %(low)i            ; count
+lc r2 %(high)i
+lc r3 0
+lc r4 1
+lc r5 7
+
+call_loop:
+    and r6 r1 r5        ; argument
+    js multiply
+    add r0 r0 r6
+    sub r1 r1 r4
+    sbc r2
+    bne r1 r3 call_loop
+    bne r2 r3 call_loop
+
+sys 0
+
+; Each call shifts the registers by three, so the caller's r4 and r6 are r7
+; and r9. The product is returned in r9.
+multiply: 3
+    lc r0 0x00
+    lc r1 0x40
+    add r0 r0 r9
+    ld r2 r0 r1         ; multiplier from the table at 0x4000
+    lc r0 0             ; product
+    lc r1 0
+    beq r2 r1 multiply_done
+    multiply_loop:
+        add r0 r0 r9
+        sub r2 r2 r7
+        bne r2 r1 multiply_loop
+    multiply_done:
+    cpy r9 r0
+    ret
+"""
+
+def copy_workload(length):
+
+    r = random.Random(1)
+    values = bytes(r.getrandbits(8) for i in range(length))
+    source = copy_source % {"length": length, "low": length & 0xff,
+                            "high": length >> 8}
+    return source, 0, [(0x4000, values)]
+
+def recursion_workload(count):
+
+    source = recursion_source % {"count": count, "low": count & 0xff,
+                                 "high": count >> 8}
+    return source, 0, []
+
+def pure_calls_workload(count):
+
+    r = random.Random(3)
+    table = bytes(r.randrange(64, 256) for i in range(8))
+    source = pure_calls_source % {"count": count, "low": count & 0xff,
+                                  "high": count >> 8}
+    return source, 0, [(0x4000, table)]
+
+def decompress_workload(length):
+
+    # Decompress text made from the words in the sample data, placing the
+    # output at 0x1000 and the compressed data after it.
+    from compression.compress import compress
+
+    r = random.Random(2)
+    words = read_data("sample.txt").split()
+    text = bytearray()
+    while len(text) < length:
+        text += r.choice(words) + b" "
+    text = bytes(text[:length])
+
+    dest = 0x1000
+    src = dest + length
+    end = dest + length
+    compressed = compress(text, 4)
+    if src + len(compressed) > 0x10000:
+        raise ValueError("Decompressed size too large for the memory available.")
+
+    registers = {"src": src & 0xff, "src_high": src >> 8,
+                 "dest": dest & 0xff, "dest_high": dest >> 8,
+                 "end": end & 0xff, "end_high": end >> 8}
+
+    def replace(match):
+        return "lc %s %i" % (match.group(1), registers[match.group(1)])
+
+    source = open(os.path.join(programs_dir, "decompress.txt")).read()
+    source = re.sub(r"^lc (src|src_high|dest|dest_high|end|end_high) \S+",
+                    replace, source, flags=re.M)
+    return source, 0, [(src, compressed)]
+
+def test_workload(name):
+
+    # Use the base address and data described in the test's expected results,
+    # skipping tests that are not meant to be run.
+    from compression.compress import compress
+
+    base = 0
+    preloads = []
+    for pieces in read_spec(name):
+        if pieces[0] in ("error", "norun"):
+            return None
+        elif pieces[0] == "base":
+            base = get_int(pieces[1])
+        elif pieces[0] == "data":
+            preloads.append((get_int(pieces[1]), read_data(pieces[2])))
+        elif pieces[0] == "compressed":
+            preloads.append((get_int(pieces[1]),
+                             compress(read_data(pieces[2]), get_int(pieces[3]))))
+
+    source = open(os.path.join(programs_dir, name + ".txt")).read()
+    return source, base, preloads
+
+def workloads(size):
+
+    items = []
+    for name in find_tests([]):
+        workload = test_workload(name)
+        if workload:
+            items.append((name, workload))
+
+    items.append(("copy-loop", copy_workload(0x4000)))
+    items.append(("recursion", recursion_workload(2000)))
+    items.append(("pure-calls", pure_calls_workload(2000)))
+    items.append(("decompress-large", decompress_workload(size)))
+    return items
+
+def peak_rss():
+
+    # Return the peak resident set size of this process in kilobytes, or None
+    # if it is not available. The value reported by getrusage includes the
+    # peak of the process that started this one, so it is read from /proc.
+    try:
+        for line in open("/proc/self/status"):
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def run_workload(item):
+
+    # Run in a fresh process started by run_job, so that the peak memory use
+    # is that of this workload alone. The time that the program starts
+    # running is returned so that the startup time can be measured from the
+    # creation of the process.
+    name, (source, base, preloads), engine = item
+
+    import assembler, simulator
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        code = assembler.assemble(source.splitlines(True), base,
+                                  directory=programs_dir)
+        simulator.load(code, base, preloads)
+        started_at = time.time()
+        started = time.perf_counter()
+        simulator.engines[engine]()
+    finished = time.perf_counter()
+
+    state = {
+        "registers": simulator.stack[simulator.sp:],
+        "sp": simulator.sp, "rsp": simulator.rsp,
+        "rstack": simulator.rstack[:],
+        "pc": simulator.pc, "cb": simulator.cb,
+        "memory": bytes(simulator.data),
+        "output": output.getvalue(),
+        "steps": simulator.steps
+        }
+
+    return {
+        "name": name, "engine": engine,
+        "steps": simulator.steps,
+        "started_at": started_at,
+        "elapsed": finished - started,
+        "peak_rss": peak_rss(),
+        "state": state
+        }
+
+def run_job(item):
+
+    # Run a workload in a new interpreter, so that the startup time includes
+    # starting Python and importing the tools.
+    created = time.time()
+    process = subprocess.run([sys.executable, os.path.abspath(__file__),
+                              "--worker"], input=pickle.dumps(item),
+                             stdout=subprocess.PIPE, check=True)
+    result = pickle.loads(process.stdout)
+    result["startup"] = result.pop("started_at") - created
+    return result
+
+def startup_commands(temp_dir):
+
+    # Return lists of commands that decompress the sample data with the
+    # decompress.txt test program, using the shorthand tool and using the
+    # separate tools with temporary files, preceded by a command that only
+    # starts Python.
+    tools_dir = os.path.dirname(os.path.abspath(__file__))
+    python = sys.executable
+    source = os.path.join(programs_dir, "decompress.txt")
+    sample = os.path.join(data_dir, "sample.txt")
+    code = os.path.join(temp_dir, "decompress.bin")
+    compressed = os.path.join(temp_dir, "sample.shz")
+
+    return [
+        ("python", [[python, "-c", "pass"]]),
+        ("shorthand", [[python, os.path.join(tools_dir, "shorthand.py"), "run",
+                        source, "--data", sample, "--compress-data"]]),
+        ("separate tools", [
+            [python, os.path.join(tools_dir, "compression", "compress.py"),
+             "--compress", sample, compressed],
+            [python, os.path.join(tools_dir, "assembler.py"), source, code],
+            [python, os.path.join(tools_dir, "simulator.py"), "-d", "8192",
+             compressed, code]
+            ])
+        ]
+
+def measure_startup(repeats):
+
+    # Report the fastest time taken to run each list of commands.
+    temp_dir = tempfile.mkdtemp()
+    print("Commands           Time ms")
+    for name, commands in startup_commands(temp_dir):
+        fastest = None
+        for i in range(repeats):
+            start = time.perf_counter()
+            for command in commands:
+                subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+            elapsed = time.perf_counter() - start
+            if fastest is None or elapsed < fastest:
+                fastest = elapsed
+        print("%-16s %9.1f" % (name, fastest * 1000))
+
+def differences(first, second):
+
+    # Return descriptions of the parts of two machine states that differ.
+    found = []
+    for key in "registers", "sp", "rsp", "rstack", "pc", "cb", "output", "steps":
+        if first[key] != second[key]:
+            found.append("%s %r != %r" % (key, first[key], second[key]))
+
+    a, b = first["memory"], second["memory"]
+    if a != b:
+        changed = [i for i in range(len(a)) if a[i] != b[i]]
+        found.append("memory differs at %i addresses from 0x%04x to 0x%04x" % (
+                     len(changed), changed[0], changed[-1]))
+    return found
+
+
+if __name__ == "__main__":
+
+    if sys.argv[1:] == ["--worker"]:
+        result = run_workload(pickle.load(sys.stdin.buffer))
+        pickle.dump(result, sys.stdout.buffer)
+        sys.exit()
+
+    import simulator
+
+    args = sys.argv[:]
+    e, engine_names = opt(args, "-e", 1, [",".join(sorted(simulator.engines))])
+    n, size = opt(args, "-n", 1, ["16384"])
+    r, repeats = opt(args, "-r", 1, ["1"])
+    startup = opt(args, "-s")
+
+    if startup:
+        measure_startup(get_int(repeats))
+        sys.exit()
+
+    engines = engine_names.split(",")
+    for engine in engines:
+        if engine not in simulator.engines:
+            sys.stderr.write("Unknown engine '%s'.\n" % engine)
+            usage(args)
+
+    items = workloads(get_int(size))
+    if args[1:]:
+        items = [item for item in items if item[0] in args[1:]]
+        if not items:
+            usage(args)
+
+    jobs = []
+    for name, workload in items:
+        for engine in engines:
+            for i in range(get_int(repeats)):
+                jobs.append((name, workload, engine))
+
+    print("Workload         Engine    Instructions    Instr/s  Startup ms  Peak RSS KB")
+
+    results = {}
+    for job in jobs:
+        result = run_job(job)
+        key = (result["name"], result["engine"])
+        # Keep the fastest of the repeated runs.
+        if key in results and results[key]["elapsed"] <= result["elapsed"]:
+            continue
+        results[key] = result
+
+    mismatches = 0
+    for name, workload in items:
+        first = None
+        for engine in engines:
+            result = results[(name, engine)]
+            rate = result["steps"] / max(result["elapsed"], 1e-9)
+            if result["peak_rss"] is None:
+                peak = "-"
+            else:
+                peak = str(result["peak_rss"])
+            print("%-16s %-8s %13i %10.0f %11.2f %12s" % (
+                  name, engine, result["steps"], rate,
+                  result["startup"] * 1000, peak))
+
+            if first is None:
+                first = result
+                continue
+
+            for description in differences(first["state"], result["state"]):
+                mismatches += 1
+                print("  %s and %s engines differ: %s" % (
+                      first["engine"], engine, description))
+
+    if mismatches:
+        print("%i differences found between engines." % mismatches)
+        sys.exit(1)
+
+    sys.exit()
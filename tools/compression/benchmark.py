@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from compress import compress, compress_blocks, compress_optimal, \
+                     decompress, decompress_blocks
+import json, os, platform, random, sys, time, tracemalloc
+
+sample_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           os.pardir, os.pardir, "tests", "data", "sample.txt")
+
+# The default sizes, offset bits and modes are chosen so that the benchmark
+# runs in minutes. Larger inputs and optimal parsing, which is much slower,
+# are only measured when requested.
+default_sizes = "1K,64K,1M"
+default_bits = "4"
+default_modes = "greedy,blocks"
+# The pool of processes used by the blocks mode, started before any
+# measurements are made so that the time taken to start it is not included.
+pool = None
+
+def usage():
+    sys.stderr.write("Usage: %s [--sizes <size>[,<size>...]] [--bits <bits>[,<bits>...]] "
+                     "[--modes <mode>[,<mode>...]] "
+                     "[--output <results file>] [--baseline <results file>] "
+                     "[--threshold <fraction>]\n" % sys.argv[0])
+    sys.exit(1)
+
+def parse_size(s):
+
+    s = s.upper()
+    for suffix, scale in ("K", 1024), ("M", 1024 * 1024):
+        if s.endswith(suffix):
+            return int(s[:-1]) * scale
+    return int(s)
+
+# Each generator returns a deterministic input of the requested size.
+
+def text_input(size):
+
+    r = random.Random(1)
+    words = open(sample_path, "rb").read().split() + [
+        b"the", b"a", b"of", b"and", b"to", b"in", b"is", b"program", b"data",
+        b"register", b"memory", b"address", b"instruction", b"byte"]
+    output = bytearray()
+    while len(output) < size:
+        output += r.choice(words)
+        if r.random() < 0.1:
+            output += b"\n"
+        else:
+            output += b" "
+    return bytes(output[:size])
+
+def binary_input(size):
+    r = random.Random(2)
+    return bytes(r.getrandbits(8) for i in range(size))
+
+def sparse_input(size):
+
+    # Mostly zeros with occasional random values.
+    r = random.Random(3)
+    output = bytearray(size)
+    for i in range(0, size, 16):
+        output[i + r.randrange(min(16, size - i))] = r.getrandbits(8)
+    return bytes(output)
+
+def repetitive_input(size):
+
+    # A repeated pattern with occasional changes.
+    r = random.Random(4)
+    pattern = bytes(r.getrandbits(8) for i in range(64))
+    output = bytearray((pattern * (size // 64 + 1))[:size])
+    for i in range(size // 100):
+        output[r.randrange(size)] = r.getrandbits(8)
+    return bytes(output)
+
+generators = [
+    ("text", text_input),
+    ("binary", binary_input),
+    ("sparse", sparse_input),
+    ("repetitive", repetitive_input)
+    ]
+
+def corpus(sizes):
+
+    inputs = [("sample", open(sample_path, "rb").read())]
+    for name, generator in generators:
+        for size in sizes:
+            inputs.append((name, generator(size)))
+    return inputs
+
+# Each mode is a pair of functions that compress and decompress data with the
+# given offset bits and window mode, and the window modes it supports.
+
+def compress_optimal_window(data, offset_bits, window):
+    return compress_optimal(data, offset_bits)
+
+def compress_pooled_blocks(data, offset_bits, window):
+    return compress_blocks(data, 4096, offset_bits, window, pool = pool)
+
+def decompress_pooled_blocks(c, offset_bits, window):
+    return decompress_blocks(c, offset_bits, window, pool = pool)
+
+modes = {
+    "greedy": (compress, decompress, ("output", "compressed")),
+    "optimal": (compress_optimal_window, decompress, ("output",)),
+    "blocks": (compress_pooled_blocks, decompress_pooled_blocks,
+               ("output", "compressed"))
+    }
+
+def measure(fn, *args):
+
+    # Return the result of the function and the shortest time taken to call
+    # it, calling it repeatedly for at least a fifth of a second.
+    best = None
+    total = 0
+    while best is None or total < 0.2:
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        total += elapsed
+        if best is None or elapsed < best:
+            best = elapsed
+    return result, best
+
+def peak_memory(fn, *args):
+
+    # Return the peak memory allocated by Python in this process, which does
+    # not include the memory used by the pool of processes.
+    tracemalloc.start()
+    fn(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+def run_case(name, data, mode, offset_bits, window):
+
+    compressor, decompressor, windows = modes[mode]
+    c, compress_time = measure(compressor, data, offset_bits, window)
+    d, decompress_time = measure(decompressor, c, offset_bits, window)
+    if d != data:
+        raise ValueError("%s data (%i bytes) decompressed incorrectly." % (name, len(data)))
+
+    mb = len(data) / 1000000
+    return {
+        "input": name,
+        "size": len(data),
+        "mode": mode,
+        "bits": offset_bits,
+        "window": window,
+        "compressed": len(c),
+        "ratio": len(c) / max(1, len(data)),
+        "compress_mbps": mb / compress_time,
+        "decompress_mbps": mb / decompress_time,
+        "compress_peak": peak_memory(compressor, data, offset_bits, window),
+        "decompress_peak": peak_memory(decompressor, c, offset_bits, window)
+        }
+
+def key(result):
+    # Results written before modes were measured used greedy parsing.
+    return (result["input"], result["size"], result.get("mode", "greedy"),
+            result["bits"], result["window"])
+
+def compare(results, baseline, threshold):
+
+    # Report results that are worse than those in the baseline by more than
+    # the threshold, returning the number of regressions found.
+    previous = dict((key(result), result) for result in baseline["results"])
+    regressions = 0
+
+    for result in results:
+        old = previous.get(key(result))
+        if old is None:
+            continue
+
+        problems = []
+        for field in "compress_mbps", "decompress_mbps":
+            if result[field] < old[field] * (1 - threshold):
+                problems.append("%s %.3f < %.3f" % (field, result[field], old[field]))
+        for field in "compressed", "compress_peak", "decompress_peak":
+            if result[field] > old[field] * (1 + threshold):
+                problems.append("%s %i > %i" % (field, result[field], old[field]))
+
+        if problems:
+            regressions += 1
+            print("Regression: %s %i bytes, %s, %i bits, %s window: %s" % (
+                  result["input"], result["size"], result["mode"],
+                  result["bits"], result["window"], "; ".join(problems)))
+
+    return regressions
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    values = {"--sizes": default_sizes, "--bits": default_bits,
+              "--modes": default_modes, "--output": None,
+              "--baseline": None, "--threshold": "0.1"}
+
+    for name in list(values.keys()):
+        if name in args:
+            at = args.index(name)
+            if at + 1 == len(args):
+                usage()
+            values[name] = args[at + 1]
+            args = args[:at] + args[at + 2:]
+
+    if len(args) != 1:
+        usage()
+
+    sizes = list(map(parse_size, values["--sizes"].split(",")))
+    bits = list(map(int, values["--bits"].split(",")))
+    threshold = float(values["--threshold"])
+    mode_names = values["--modes"].split(",")
+    for mode in mode_names:
+        if mode not in modes:
+            sys.stderr.write("Unknown mode '%s'. Available modes: %s\n" % (
+                             mode, ", ".join(sorted(modes))))
+            sys.exit(1)
+
+    if "blocks" in mode_names:
+        import multiprocessing
+        pool = multiprocessing.Pool()
+
+    print("Input        Size  Mode     Bits  Window        Ratio  Compress MB/s  "
+          "Decompress MB/s  Peak memory")
+
+    results = []
+    for name, data in corpus(sizes):
+        for mode in mode_names:
+            for offset_bits in bits:
+                for window in modes[mode][2]:
+                    result = run_case(name, data, mode, offset_bits, window)
+                    results.append(result)
+                    print("%-10s %7i  %-7s  %4i  %-10s  %6.3f  %13.3f  %15.3f  %11i" % (
+                          name, len(data), mode, offset_bits, window,
+                          result["ratio"], result["compress_mbps"],
+                          result["decompress_mbps"],
+                          max(result["compress_peak"], result["decompress_peak"])))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    report = {"python": platform.python_version(), "results": results}
+
+    if values["--output"]:
+        f = open(values["--output"], "w")
+        json.dump(report, f, indent = 1)
+        f.close()
+
+    if values["--baseline"]:
+        baseline = json.load(open(values["--baseline"]))
+        regressions = compare(results, baseline, threshold)
+        print("%i regressions found compared to %s." % (regressions, values["--baseline"]))
+        if regressions:
+            sys.exit(1)
+
+    sys.exit()
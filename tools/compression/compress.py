@@ -15,47 +15,50 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys
+import functools, itertools, struct, sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def compress(data, offset_bits = 4, window = "output"):
 
     max_offset = (1 << offset_bits) - 1
     max_length = (1 << (7 - offset_bits)) + 2
 
+    data = bytes(data)
     special = find_least_used(data)
-    output = [special]
+    output = bytearray([special])
+
+    # Record the positions of each three byte sequence in the window so that
+    # only those positions that can provide useful matches need to be
+    # examined. The head dictionary maps each sequence to the last position
+    # it was found at, and the prev list maps each position to the previous
+    # position with the same sequence.
+    head = {}
+    prev = []
 
     i = 0
     while i < len(data):
 
-        best = []
-        b = 0
-
-        # Compare strings in the window with upcoming input, starting at the
-        # beginning of the window.
+        # Index the positions in the window that have not yet been indexed,
+        # then find the longest match between the window and the upcoming
+        # input, preferring later matches to earlier ones of the same length.
         if window == "output":
-            k = max(0, i - 128)
-            end = i
+            source = data
+            indexed = min(i, len(data) - 2)
+            lowest = max(0, i - 128)
+            longest = 259
         else:
-            k = max(0, len(output) - 128)
-            end = len(output)
-
-        while k < end:
-
-            if window == "output":
-                match = find_match(data, k, i)
-            else:
-                match = find_match_in_compressed(output, data, k, i)
-
-            # Find better matches, replacing those of equal length with later
-            # ones as they are found.
-            if len(match) >= len(best):
-                best = match
-                b = k
-
-            k += 1
+            source = output
+            indexed = len(output) - 2
+            lowest = max(0, len(output) - 128)
+            longest = 255
 
-        length = len(best)
+        index_positions(source, indexed, head, prev)
+        b, length = find_longest_match(source, data, i, lowest, longest,
+                                       head, prev)
 
         if length <= 2:
 
@@ -65,7 +68,7 @@ def compress(data, offset_bits = 4, window = "output"):
             # If the special byte occurs in the input, encode it using a
             # special sequence.
             if data[i] == special:
-                output += [special, 0]
+                output.extend((special, 0))
                 i += 1
             else:
                 output.append(data[i])
@@ -99,146 +102,769 @@ def compress(data, offset_bits = 4, window = "output"):
             if length <= max_length and offset <= max_offset:
                 # Store non-zero offset to avoid potential encoding of zero
                 # in the second byte.
-                output += [special, ((length - 3) << offset_bits) | offset]
+                output.extend((special, ((length - 3) << offset_bits) | offset))
                 i += length
 
             elif length > 3:
                 # Store offset - 1 and length - 4 to allow higher lengths
                 # to be stored.
-                output += [special, 0x80 | (offset - 1), length - 4]
+                output.extend((special, 0x80 | (offset - 1), length - 4))
                 i += length
 
             elif data[i] == special:
-                output += [special, 0]
+                output.extend((special, 0))
                 i += 1
 
             else:
                 output.append(data[i])
                 i += 1
 
-    return output
+    return bytes(output)
 
 
-def find_least_used(data):
+def compress_optimal(data, offset_bits = 4):
+
+    # Compress the data using the same format as compress() with the "output"
+    # window mode, choosing the sequence of literals and references that
+    # produces the smallest output instead of always taking the longest match.
+
+    data = bytes(data)
+    special = find_least_used(data)
+    near_lengths, near_offsets, far_lengths, far_offsets = find_all_matches(
+        data, offset_bits)
+
+    # Working backwards from the end of the input, find the smallest number
+    # of bytes needed to encode the data from each position to the end, and
+    # the length of the literal or reference (0 for a literal) to use at that
+    # position to achieve it. Ties are resolved in favour of longer matches.
+    size = [0] * (len(data) + 1)
+    choice = [0] * len(data)
+    at = size.__getitem__
+
+    for i in range(len(data) - 1, -1, -1):
+
+        if data[i] == special:
+            best = 2 + size[i + 1]
+        else:
+            best = 1 + size[i + 1]
+        length = 0
+
+        far = far_lengths[i]
+        if far >= 4:
+            j = min(range(i + far, i + 3, -1), key = at)
+            if 3 + size[j] < best:
+                best, length = 3 + size[j], j - i
+
+        near = near_lengths[i]
+        if near >= 3:
+            j = min(range(i + near, i + 2, -1), key = at)
+            if 2 + size[j] <= best:
+                best, length = 2 + size[j], j - i
+
+        size[i] = best
+        choice[i] = length
+
+    # Encode the chosen literals and references.
+    output = bytearray([special])
+
+    i = 0
+    while i < len(data):
+
+        length = choice[i]
+
+        if length == 0:
+            if data[i] == special:
+                output.extend((special, 0))
+            else:
+                output.append(data[i])
+            i += 1
+
+        elif length <= near_lengths[i]:
+            output.extend((special, ((length - 3) << offset_bits) | near_offsets[i]))
+            i += length
+
+        else:
+            output.extend((special, 0x80 | (far_offsets[i] - 1), length - 4))
+            i += length
+
+    return bytes(output)
+
+
+def find_all_matches(data, offset_bits):
+
+    # For each position in the input, find the longest match that can be
+    # encoded as a near reference and the longest match that can be encoded
+    # as a far reference, returning lists of their lengths and offsets. Any
+    # shorter prefix of these is also a match.
+    max_offset = (1 << offset_bits) - 1
+    max_length = (1 << (7 - offset_bits)) + 2
+
+    near_lengths = []
+    near_offsets = []
+    far_lengths = []
+    far_offsets = []
+
+    head = {}
+    prev = []
+
+    for i in range(len(data)):
+
+        index_positions(data, min(i, len(data) - 2), head, prev)
+        near, near_offset, far, far_offset = find_matches(data, i, max_offset,
+                                                          max_length, head, prev)
+        near_lengths.append(near)
+        near_offsets.append(near_offset)
+        far_lengths.append(far)
+        far_offsets.append(far_offset)
+
+    return near_lengths, near_offsets, far_lengths, far_offsets
+
+
+def compress_costed(data, costs, offset_bits = 4, budget = None):
+
+    # Compress the data using the same format as compress() with the "output"
+    # window mode, choosing the sequence of literals and references that is
+    # predicted to be the quickest to decompress using a table of decoding
+    # costs (see decode_cost). If a budget is given, the output is made no
+    # larger than that number of bytes if possible.
+
+    data = bytes(data)
+    special = find_least_used(data)
+    matches = find_all_matches(data, offset_bits)
+
+    choice, size = parse_costed(data, special, matches, costs, 0)
+    if budget is not None and size > budget:
+
+        # Add a cost for each byte of output, finding the smallest cost per
+        # byte that brings the size within the budget.
+        low = 0
+        high = max(costs["far"][4:]) + 1
+        best = None
+        for i in range(16):
+            choice, size = parse_costed(data, special, matches, costs, high)
+            if size <= budget:
+                best = choice
+                break
+            high *= 2
+
+        for i in range(16):
+            if best is None:
+                break
+            weight = (low + high) / 2
+            choice, size = parse_costed(data, special, matches, costs, weight)
+            if size <= budget:
+                best, high = choice, weight
+            else:
+                low = weight
+
+        if best is not None:
+            choice = best
+
+    # Encode the chosen literals and references, where near references have
+    # positive lengths and far references have negative lengths.
+    near_lengths, near_offsets, far_lengths, far_offsets = matches
+    output = bytearray([special])
+
+    i = 0
+    while i < len(data):
+
+        length = choice[i]
+
+        if length == 0:
+            if data[i] == special:
+                output.extend((special, 0))
+            else:
+                output.append(data[i])
+            i += 1
+
+        elif length > 0:
+            output.extend((special, ((length - 3) << offset_bits) | near_offsets[i]))
+            i += length
+
+        else:
+            output.extend((special, 0x80 | (far_offsets[i] - 1), -length - 4))
+            i -= length
+
+    return bytes(output)
+
+
+def parse_costed(data, special, matches, costs, weight):
 
-    freq = [0] * 256
+    # Working backwards from the end of the input, find the cheapest way to
+    # encode the data from each position to the end, where each token costs
+    # its decoding cost plus the weight for each byte it occupies. Return the
+    # list of choices made at each position and the size of the output.
+    near_lengths, near_offsets, far_lengths, far_offsets = matches
+    literal, escape = costs["literal"], costs["escape"]
+    near_costs, far_costs = costs["near"], costs["far"]
 
-    for b in data:
-        freq[b] += 1
+    best = [0] * (len(data) + 1)
+    size = [1] * (len(data) + 1)
+    choice = [0] * len(data)
+
+    for i in range(len(data) - 1, -1, -1):
+
+        if data[i] == special:
+            cost, length, n = escape + 2 * weight + best[i + 1], 0, 2
+        else:
+            cost, length, n = literal + weight + best[i + 1], 0, 1
+
+        far_weight = 3 * weight
+        for k in range(4, far_lengths[i] + 1):
+            c = far_costs[k] + far_weight + best[i + k]
+            if c < cost:
+                cost, length, n = c, -k, 3
+
+        near_weight = 2 * weight
+        for k in range(3, near_lengths[i] + 1):
+            c = near_costs[k] + near_weight + best[i + k]
+            if c <= cost:
+                cost, length, n = c, k, 2
+
+        best[i] = cost
+        choice[i] = length
+        size[i] = n + size[i + (abs(length) or 1)]
+
+    return choice, size[0]
+
+
+def decode_cost(data, costs):
+
+    # Return the predicted cost of decoding the compressed data using a table
+    # of costs. The table is a dictionary containing the fixed cost of
+    # decoding ("base"), the costs of a literal and an escaped special byte
+    # ("literal", "escape"), and lists of the costs of near and far
+    # references indexed by their lengths ("near", "far").
+    cost = costs["base"]
+    offset_bits = costs["offset_bits"]
+
+    special = data[0]
+    i = 1
+    while i < len(data):
+
+        j = data.find(special, i)
+        if j == -1:
+            cost += (len(data) - i) * costs["literal"]
+            break
+
+        cost += (j - i) * costs["literal"]
+        offset = data[j + 1]
+        if offset == 0:
+            cost += costs["escape"]
+            i = j + 2
+        elif offset & 0x80 == 0:
+            cost += costs["near"][(offset >> offset_bits) + 3]
+            i = j + 2
+        else:
+            cost += costs["far"][data[j + 2] + 4]
+            i = j + 3
+
+    return cost
+
+
+def index_positions(source, indexed, head, prev):
+
+    # Record the positions of three byte sequences in the source that have not
+    # already been recorded, up to the position given by indexed.
+    j = len(prev)
+    while j < indexed:
+        key = source[j] | (source[j + 1] << 8) | (source[j + 2] << 16)
+        prev.append(head.get(key, -1))
+        head[key] = j
+        j += 1
+
+
+def find_least_used(data):
+
+    freq = [data.count(b) for b in range(256)]
 
     try:
         # Try to find an unused byte value.
         special = freq.index(0)
     except ValueError:
         # Find the least used byte value.
-        pairs = map(lambda i: (freq[i], i), range(len(freq)))
-        pairs.sort()
-        special = pairs.pop(0)[1]
+        special = freq.index(min(freq))
 
     return special
 
 
-def find_match(data, k, i):
+def find_longest_match(source, data, i, lowest, longest, head, prev):
 
-    # Compare the bytes in the window, starting at index k, with the bytes in
-    # the upcoming data, starting at index i.
+    # Compare the bytes in the source, starting at each index k in the window
+    # that begins with the same three bytes as the upcoming data, with the
+    # bytes in the upcoming data, starting at index i. The source is either
+    # the input data itself or the compressed output.
     #
     # | data   i        |
     #          v
     # | window |        |
     #   ^           ^
     #   k --------- j
+    #
+    # Matches in the compressed output cannot extend beyond its end. Matches
+    # shorter than three bytes are never recorded, so they are not reported.
 
-    match = []
-    j = i
+    b = length = 0
+    limit = min(longest, len(data) - i)
+    if limit < 3:
+        return b, length
 
-    while len(match) < 259:
+    key = data[i] | (data[i + 1] << 8) | (data[i + 2] << 16)
+    k = head.get(key, -1)
 
-        if j == len(data) or data[k] != data[j]:
-            return match
+    # Visit the candidates from the latest to the earliest so that only a
+    # longer match can replace the current best one.
+    while k >= lowest:
 
-        match.append(data[k])
+        # Only compare candidates that could provide a longer match, checking
+        # the byte that would extend the current best match first.
+        m = min(limit, len(source) - k)
+        if m > length and source[k + length] == data[i + length]:
 
-        k += 1
-        j += 1
+            n = 3
+            while n < m and source[k + n] == data[i + n]:
+                n += 1
 
-    return match
+            if n > length:
+                b, length = k, n
+                if n == limit:
+                    break
 
+        k = prev[k]
 
-def find_match_in_compressed(output, data, k, i):
+    return b, length
 
-    # Compare the bytes in the compressed data, starting at index k, with the
-    # bytes in the upcoming data, starting at index i.
-    #
-    #          i
-    # | data   |    ^   |
-    #     k ------- j
-    #     v
-    # | output |
 
-    match = []
-    j = i
+def find_matches(data, i, max_offset, max_length, head, prev):
 
-    while len(match) < 255 and k < len(output):
+    # Find the longest match for the upcoming data at index i that can be
+    # encoded as a near reference, with an offset of up to max_offset and a
+    # length of up to max_length, and the longest match that can be encoded as
+    # a far reference, with an offset of up to 128 and a length of up to 259.
 
-        if j == len(data) or output[k] != data[j]:
-            return match
+    near = near_offset = far = far_offset = 0
+    limit = min(259, len(data) - i)
+    if limit < 3:
+        return near, near_offset, far, far_offset
 
-        match.append(output[k])
+    key = data[i] | (data[i + 1] << 8) | (data[i + 2] << 16)
+    k = head.get(key, -1)
+    lowest = max(0, i - 128)
 
-        k += 1
-        j += 1
+    # Candidates are visited from the latest to the earliest, so those that
+    # can be encoded as near references are visited first.
+    while k >= lowest:
 
-    return match
+        # Compare all the candidates that can be encoded as near references,
+        # but only those far candidates that could provide a longer match,
+        # checking the byte that would extend the current best match first.
+        if i - k <= max_offset or (far < limit and data[k + far] == data[i + far]):
 
+            n = 3
+            while n < limit and data[k + n] == data[i + n]:
+                n += 1
 
-def decompress(data, offset_bits = 4, window = "output", stop_at = None):
+            if i - k <= max_offset and min(n, max_length) > near:
+                near, near_offset = min(n, max_length), i - k
 
-    offset_mask = (1 << offset_bits) - 1
+            if n > far:
+                far, far_offset = n, i - k
 
-    special = data[0]
-    output = []
+            if far == limit and (near == min(max_length, limit) or
+                                 i - k >= max_offset):
+                break
+
+        k = prev[k]
+
+    return near, near_offset, far, far_offset
 
-    i = 1
-    while i < len(data):
 
-        b = data[i]
+def decompress(data, offset_bits = 4, window = "output"):
 
-        if b != special:
-            output.append(b)
+    decompressor = Decompressor(offset_bits, window)
+    output = decompressor.feed(data)
+    decompressor.close()
+    return output
+
+
+def decompress_stream(chunks, offset_bits = 4, window = "output"):
+
+    # Decompress each chunk of compressed data from an iterable, yielding the
+    # decompressed data as it becomes available.
+    decompressor = Decompressor(offset_bits, window)
+    for chunk in chunks:
+        output = decompressor.feed(chunk)
+        if output:
+            yield output
+    decompressor.close()
+
+
+class Decompressor:
+
+    # Decompresses data that is supplied in chunks of any size, keeping only
+    # the history needed to resolve references: the last 128 bytes of output
+    # for the "output" window mode, or of compressed data for the "compressed"
+    # window mode, plus any incomplete reference at the end of the last chunk.
+
+    def __init__(self, offset_bits = 4, window = "output"):
+
+        self.offset_bits = offset_bits
+        self.offset_mask = (1 << offset_bits) - 1
+        self.window = window
+
+        self.special = None
+        self.history = b""
+        self.pending = b""
+
+        # The numbers of compressed bytes consumed and decompressed bytes
+        # produced so far.
+        self.consumed = 0
+        self.produced = 0
+
+    def feed(self, chunk):
+
+        data = self.history + self.pending + bytes(chunk)
+        i = len(self.history)
+
+        if self.special is None:
+            if i == len(data):
+                return b""
+            self.special = data[i]
             i += 1
-        else:
-            offset = data[i + 1]
-            if offset == 0:
-                output.append(special)
-                i += 2
 
+        if self.window == "output":
+            output = bytearray(self.history)
+            start = len(output)
+        else:
+            output = bytearray()
+            start = 0
+
+        special = self.special
+        offset_bits = self.offset_bits
+        offset_mask = self.offset_mask
+
+        while i < len(data):
+
+            # Copy any literals before the next special byte in one operation.
+            j = data.find(special, i)
+            if j == -1:
+                output += data[i:]
+                i = len(data)
+            elif j > i:
+                output += data[i:j]
+                i = j
+
+            # Leave incomplete sequences until more data is supplied.
+            elif i + 1 == len(data):
+                break
             else:
-                j = i
+                offset = data[i + 1]
+                if offset == 0:
+                    output.append(special)
+                    i += 2
+                    continue
 
-                if offset & 0x80 == 0:
+                elif offset & 0x80 == 0:
                     count = (offset >> offset_bits) + 3
                     offset = offset & offset_mask
                     i += 2
+                elif i + 2 == len(data):
+                    break
                 else:
                     offset = (offset & 0x7f) + 1
                     count = data[i + 2] + 4
                     i += 3
 
-                if window == "compressed":
-                    offset -= count
+                if self.window == "compressed":
+                    # Copy the bytes from the compressed data preceding the
+                    # reference, which are never overlapped by it.
+                    output += data[j - offset:j - offset + count]
 
-                while count > 0:
-                    if window == "output":
-                        output.append(output[-offset])
-                    else:
-                        output.append(data[j - offset - count])
-                    count -= 1
+                elif offset >= count:
+                    output += output[-offset:len(output) - offset + count]
 
-        if stop_at != None and len(output) > stop_at:
-            return data[:i], output
+                else:
+                    # The reference overlaps the bytes it produces, repeating
+                    # the last offset bytes of the output, so repeat those
+                    # bytes enough times to copy them in one operation.
+                    chunk = output[-offset:] * (count // offset + 1)
+                    output += chunk[:count]
 
-    return output
+        self.consumed += i - len(self.history)
+        self.pending = data[i:]
+
+        if self.window == "output":
+            self.history = bytes(output[-128:])
+        else:
+            self.history = data[max(0, i - 128):i]
+
+        output = bytes(output[start:])
+        self.produced += len(output)
+        return output
+
+    def close(self):
+
+        if self.pending:
+            raise ValueError("Compressed data ends with an incomplete reference.")
+
+
+def compress_blocks(data, block_size = 4096, offset_bits = 4,
+                    window = "output", optimal = False, processes = None,
+                    pool = None):
+
+    # Split the data into blocks and compress each of them independently,
+    # using a pool of processes, which is started unless one is given,
+    # returning a container that begins with an index of the blocks. All
+    # values in the index are little-endian:
+    #
+    # block size                    16 bits
+    # number of blocks (n)          16 bits
+    # uncompressed length           32 bits
+    # offsets of blocks 0 to n      32 bits each
+    #
+    # Offsets are given from the start of the container, with the final
+    # offset marking the end of the last block.
+
+    if not 0 < block_size < 0x10000:
+        raise ValueError("Block size must be between 1 and 65535 bytes.")
+
+    blocks = [data[i:i + block_size] for i in range(0, len(data), block_size)]
+    if len(blocks) >= 0x10000:
+        raise ValueError("Too many blocks for the block size given.")
+
+    if optimal:
+        fn = functools.partial(compress_optimal, offset_bits = offset_bits)
+    else:
+        fn = functools.partial(compress, offset_bits = offset_bits,
+                               window = window)
+
+    compressed = parallel_map(fn, blocks, processes, pool)
+
+    offset = 8 + (len(blocks) + 1) * 4
+    index = [struct.pack("<HHI", block_size, len(blocks), len(data))]
+    for c in compressed:
+        index.append(struct.pack("<I", offset))
+        offset += len(c)
+    index.append(struct.pack("<I", offset))
+
+    return b"".join(index + compressed)
+
+
+def read_block_index(container):
+
+    # Return the block size, uncompressed length and list of block offsets
+    # from the index of a container.
+    block_size, n, length = struct.unpack("<HHI", container[:8])
+    offsets = struct.unpack("<%iI" % (n + 1), container[8:12 + n * 4])
+    return block_size, length, offsets
+
+
+def decompress_block(container, number, offset_bits = 4, window = "output"):
+
+    # Decompress a single block from a container.
+    block_size, length, offsets = read_block_index(container)
+    if not 0 <= number < len(offsets) - 1:
+        raise ValueError("Block %i is not in the container, which has %i blocks." % (
+                         number, len(offsets) - 1))
+    start, end = offsets[number], offsets[number + 1]
+    return decompress(container[start:end], offset_bits, window)
+
+
+def decompress_blocks(container, offset_bits = 4, window = "output",
+                      processes = None, pool = None):
+
+    block_size, length, offsets = read_block_index(container)
+    blocks = []
+    for i in range(len(offsets) - 1):
+        blocks.append(container[offsets[i]:offsets[i + 1]])
+
+    fn = functools.partial(decompress, offset_bits = offset_bits,
+                           window = window)
+    return b"".join(parallel_map(fn, blocks, processes, pool))
+
+
+def parallel_map(fn, items, processes = None, pool = None):
+
+    # Use the pool of processes if one is given. Otherwise, only start a pool
+    # if there is more than one item to process.
+    if pool is not None:
+        return pool.map(fn, items)
+    elif len(items) < 2 or processes == 1:
+        return list(map(fn, items))
+
+    # Import multiprocessing here because it is slow to import and is not
+    # needed by most callers.
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(fn, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def count_tokens(data, offset_bits = 4):
+
+    # Count the literals, escaped special bytes, near and far references in
+    # compressed data, and the number of bytes copied by references. These
+    # determine the amount of work a decompressor needs to do.
+    literals = escapes = near = far = copied = 0
+
+    special = data[0]
+    i = 1
+    while i < len(data):
+
+        j = data.find(special, i)
+        if j == -1:
+            literals += len(data) - i
+            break
+
+        literals += j - i
+        offset = data[j + 1]
+        if offset == 0:
+            escapes += 1
+            i = j + 2
+        elif offset & 0x80 == 0:
+            near += 1
+            copied += (offset >> offset_bits) + 3
+            i = j + 2
+        else:
+            far += 1
+            copied += data[j + 2] + 4
+            i = j + 3
+
+    return literals, escapes, near, far, copied
+
+
+# Compressed data can be preceded by a header that records the parameters
+# used to compress it:
+#
+# "SS" 1 "HZ"                   magic
+# flags                         offset bits (bits 0-2), compressed window (bit 3)
+# number of transforms (n)
+# transforms 0 to n-1           the transforms applied before compression
+#
+# The magic value begins with a special byte followed by a reference of length
+# 3 and offset 1. A reference cannot be the first token in compressed data, as
+# nothing precedes it, so the magic value is never the start of a stream.
+
+header_magic = b"SS\x01HZ"
+transform_ids = {"merge": 1, "delta": 2, "mtf": 3}
+
+def write_header(offset_bits, window, transforms):
+
+    flags = offset_bits
+    if window == "compressed":
+        flags |= 0x08
+
+    ids = [transform_ids[name] for name in transforms]
+    return header_magic + bytes([flags, len(ids)] + ids)
+
+
+def read_header(data):
+
+    # Return the offset bits, window mode, transforms and header length for
+    # data that begins with a header, or None if there is no header. Raise a
+    # ValueError if the header is invalid.
+    m = len(header_magic)
+    if data[:m] != header_magic:
+        return None
+    if len(data) < m + 2:
+        raise ValueError("The header is incomplete.")
+
+    flags, n = data[m], data[m + 1]
+    if flags & 0xf0 or flags & 0x07 == 0:
+        raise ValueError("The header contains invalid flags (%i)." % flags)
+    if flags & 0x08:
+        window = "compressed"
+    else:
+        window = "output"
+
+    ids = data[m + 2:m + 2 + n]
+    if len(ids) < n:
+        raise ValueError("The header is incomplete.")
+
+    names = dict((id, name) for name, id in transform_ids.items())
+    transforms = []
+    for id in ids:
+        if id not in names:
+            raise ValueError("The header contains an unknown transform (%i)." % id)
+        transforms.append(names[id])
+
+    return flags & 0x07, window, transforms, m + 2 + n
+
+
+def evaluate_parameters(data, parameters):
+
+    # Compress the data with the given parameters, checking that it can be
+    # decompressed correctly, and return the compressed data and the
+    # numbers of each kind of token it contains.
+    offset_bits, window, optimal, transforms = parameters
+
+    original = data
+    data = apply_transforms(transforms, data)
+
+    if optimal:
+        c = compress_optimal(data, offset_bits = offset_bits)
+    else:
+        c = compress(data, offset_bits = offset_bits, window = window)
+
+    d = decompress(c, offset_bits = offset_bits, window = window)
+    d = invert_transforms(transforms, d)
+
+    if d != original:
+        return parameters, None, None
+
+    return parameters, c, count_tokens(c, offset_bits)
+
+
+# The chains of transforms tried by auto_compress().
+auto_transforms = [[], ["merge"], ["delta"], ["mtf"], ["delta", "merge"]]
+
+def auto_compress(data, processes = None):
+
+    # Compress the data using every combination of parameters in a pool of
+    # processes, returning the smallest result with a header and a list of
+    # the results for each combination. Results of the same size are ranked
+    # by the number of tokens to decode.
+    combinations = []
+    for offset_bits in range(2, 6):
+        for window, optimal in ("output", False), ("output", True), ("compressed", False):
+            for transforms in auto_transforms:
+                combinations.append((offset_bits, window, optimal, transforms))
+
+    fn = functools.partial(evaluate_parameters, data)
+    results = parallel_map(fn, combinations, processes)
+
+    best = None
+    for parameters, c, tokens in results:
+        if c is None:
+            continue
+        rank = (len(c), sum(tokens[:4]))
+        if best is None or rank < best[0]:
+            best = rank, parameters, c
+
+    rank, (offset_bits, window, optimal, transforms), c = best
+    return write_header(offset_bits, window, transforms) + c, results
+
+
+# Transforms rearrange data before it is compressed, making it more suitable
+# for compression, and are inverted after it is decompressed. Each one is
+# implemented with NumPy if it is available, or with operations on bytes
+# otherwise.
+
+def apply_transforms(names, data):
+
+    for name in names:
+        data = transform_functions[name][0](data)
+    return bytes(data)
+
+
+def invert_transforms(names, data):
+
+    for name in reversed(names):
+        data = transform_functions[name][1](data)
+    return bytes(data)
 
 
 def merge(data):
@@ -246,55 +872,124 @@ def merge(data):
     # Take the lowest 4 bits of each byte and pack them together, then take
     # the highest 4 bits of each byte and pack them together. Append the last
     # byte in an odd-sized stream.
-    output = []
+    data = bytes(data)
+    n = len(data) & ~1
 
-    i = 0
-    while i < len(data) - 1:
-        output.append((data[i] & 0x0f) | ((data[i+1] & 0x0f) << 4))
-        i += 2
+    if numpy is not None:
+        a = numpy.frombuffer(data, numpy.uint8)
+        even, odd = a[0:n:2], a[1:n:2]
+        low = (even & 0x0f) | ((odd & 0x0f) << 4)
+        high = (even & 0xf0) | (odd >> 4)
+        return low.tobytes() + high.tobytes() + data[n:]
 
-    i = 0
-    while i < len(data) - 1:
-        output.append((data[i] & 0xf0) | ((data[i+1] & 0xf0) >> 4))
-        i += 2
+    even, odd = data[0:n:2], data[1:n:2]
+    low = or_bytes(even.translate(low_nibble), odd.translate(low_to_high))
+    high = or_bytes(even.translate(high_nibble), odd.translate(high_to_low))
+    return low + high + data[n:]
 
-    if len(data) % 2 == 1:
-        output.append(data[-1])
 
-    return output
+def unmerge(data):
 
+    data = bytes(data)
+    h = len(data) // 2
+    low, high = data[:h], data[h:h * 2]
 
-def unmerge(data):
+    if numpy is not None:
+        low = numpy.frombuffer(low, numpy.uint8)
+        high = numpy.frombuffer(high, numpy.uint8)
+        output = numpy.empty(h * 2, numpy.uint8)
+        output[0::2] = (low & 0x0f) | (high & 0xf0)
+        output[1::2] = (low >> 4) | ((high & 0x0f) << 4)
+        return output.tobytes() + data[h * 2:]
 
-    output = []
+    output = bytearray(h * 2)
+    output[0::2] = or_bytes(low.translate(low_nibble), high.translate(high_nibble))
+    output[1::2] = or_bytes(low.translate(high_to_low), high.translate(low_to_high))
+    return bytes(output) + data[h * 2:]
 
-    i = 0
-    hl = len(data)/2
-    while i < hl:
-        output.append(data[i] & 0x0f)
-        output.append(data[i] >> 4)
-        i += 1
-
-    j = 0
-    while i < hl*2:
-        output[j] = output[j] | (data[i] & 0xf0)
-        output[j+1] = output[j+1] | ((data[i] & 0x0f) << 4)
-        i += 1
-        j += 2
-
-    if len(data) % 2 == 1:
-        output.append(data[-1])
 
-    return output
+def delta(data):
+
+    # Replace each byte with its difference from the previous byte.
+    data = bytes(data)
+
+    if numpy is not None:
+        a = numpy.frombuffer(data, numpy.uint8)
+        output = a.copy()
+        output[1:] -= a[:-1]
+        return output.tobytes()
+
+    return bytes((b - a) & 0xff for a, b in zip(b"\x00" + data, data))
+
+
+def undelta(data):
+
+    data = bytes(data)
+
+    if numpy is not None:
+        a = numpy.frombuffer(data, numpy.uint8)
+        return numpy.cumsum(a, dtype = numpy.uint8).tobytes()
+
+    return bytes(v & 0xff for v in itertools.accumulate(data))
+
+
+def mtf(data):
 
+    # Replace each byte with its position in a list of byte values, moving
+    # each value to the front of the list after it is used. Recently used
+    # values are encoded as small numbers.
+    table = list(range(256))
+    output = bytearray(len(data))
 
-def hexdump(data):
+    for i, b in enumerate(data):
+        j = table.index(b)
+        output[i] = j
+        if j:
+            del table[j]
+            table.insert(0, b)
+
+    return bytes(output)
+
+
+def unmtf(data):
+
+    table = list(range(256))
+    output = bytearray(len(data))
+
+    for i, j in enumerate(data):
+        b = table[j]
+        output[i] = b
+        if j:
+            del table[j]
+            table.insert(0, b)
+
+    return bytes(output)
+
+
+def or_bytes(a, b):
+    n = len(a)
+    return (int.from_bytes(a, "little") | int.from_bytes(b, "little")).to_bytes(n, "little")
+
+
+low_nibble = bytes(b & 0x0f for b in range(256))
+high_nibble = bytes(b & 0xf0 for b in range(256))
+low_to_high = bytes((b & 0x0f) << 4 for b in range(256))
+high_to_low = bytes(b >> 4 for b in range(256))
+
+transform_functions = {
+    "merge": (merge, unmerge),
+    "delta": (delta, undelta),
+    "mtf": (mtf, unmtf)
+    }
+
+
+def hexdump(data, f = sys.stdout):
 
     i = 0
     while i < len(data):
 
         d = data[i:i+16]
-        print(" ".join(map(lambda x: "%02x" % x, d)))
+        print(" ".join(map(lambda x: "%02x" % x, d)), file = f)
         i += 16
 
 
@@ -311,10 +1006,45 @@ if __name__ == "__main__":
     else:
         mode = "output"
 
-    do_merge = "--merge" in args
-    if do_merge:
+    # Transforms are given as a comma-separated list, with --merge as a
+    # shorthand for the merge transform.
+    chain = []
+    if "--merge" in args:
+        chain.append("merge")
         args.remove("--merge")
 
+    try:
+        at = args.index("--transform")
+        chain += args[at + 1].split(",")
+        args = args[:at] + args[at + 2:]
+    except ValueError:
+        pass
+
+    for name in chain:
+        if name not in transform_functions:
+            sys.stderr.write("Unknown transform '%s'.\n" % name)
+            sys.exit(1)
+
+    optimal = "--optimal" in args
+    if optimal:
+        args.remove("--optimal")
+
+    # A table of decoding costs written by tools/decodecosts.py selects the
+    # encoding that is quickest to decompress, optionally within a budget.
+    try:
+        at = args.index("--costs")
+        costs_path = args[at + 1]
+        args = args[:at] + args[at + 2:]
+    except ValueError:
+        costs_path = None
+
+    try:
+        at = args.index("--budget")
+        budget = int(args[at + 1])
+        args = args[:at] + args[at + 2:]
+    except ValueError:
+        budget = None
+
     try:
         bits = args.index("--bits")
         offset_bits = int(args[bits + 1])
@@ -322,55 +1052,206 @@ if __name__ == "__main__":
     except ValueError:
         offset_bits = 4
 
-    print("Using %i bits for offsets." % offset_bits)
+    # Containers of blocks are created by passing an optional block size when
+    # compressing. When decompressing, either the whole container or a single
+    # block can be decompressed.
+    use_blocks = "--blocks" in args
+    block_size = 4096
+    if use_blocks:
+        at = args.index("--blocks")
+        if "--compress" in args and args[at + 1:at + 2] and args[at + 1].isdigit():
+            block_size = int(args[at + 1])
+            args = args[:at] + args[at + 2:]
+        else:
+            args.remove("--blocks")
+
+    auto = "--auto" in args
+    if auto:
+        args.remove("--auto")
+
+    try:
+        at = args.index("--block")
+        block_number = int(args[at + 1])
+        args = args[:at] + args[at + 2:]
+        use_blocks = True
+    except ValueError:
+        block_number = None
 
     if len(args) != 4:
-        sys.stderr.write("Usage: %s --compress|--decompress [--output|--compressed] [--merge] [--bits <bits>] <input file> <output file>\n" % sys.argv[0])
+        sys.stderr.write("Usage: %s --compress|--decompress [--output|--compressed] [--merge] [--transform <name>[,<name>...]] [--optimal] [--costs <cost file> [--budget <size>]] [--auto] [--bits <bits>] [--blocks [<block size>]] [--block <number>] <input file> <output file>\n" % sys.argv[0])
         sys.exit(1)
 
-    command = args[1]
-    in_f = open(args[2], "rb")
-    out_f = open(args[3], "wb")
+    if block_number is not None and args[1] == "--compress":
+        sys.stderr.write("Single blocks can only be decompressed. Use --blocks "
+                         "to compress data in blocks.\n")
+        sys.exit(1)
 
-    data = [b for b in in_f.read()]
+    if use_blocks and chain:
+        sys.stderr.write("Transformed data cannot be stored in blocks.\n")
+        sys.exit(1)
 
-    if command == "--compress":
+    if optimal and mode != "output":
+        sys.stderr.write("Optimal compression is only available with the output window mode.\n")
+        sys.exit(1)
 
-        print("Input size:", len(data))
-        if do_merge:
-            original_data = data
-            data = merge(data)
+    if budget is not None and not costs_path:
+        sys.stderr.write("The --budget option can only be used with --costs.\n")
+        sys.exit(1)
 
-        c = compress(data, offset_bits = offset_bits, window = mode)
-        print("Compressed:", len(c))
-        try:
-            out_f.write(bytes(c))
-        except ValueError:
-            hexdump(c)
-            raise
-
-        d = decompress(c, offset_bits = offset_bits, window = mode)
-        if do_merge:
-            d = unmerge(d)
+    if costs_path:
+        if mode != "output" or use_blocks or optimal:
+            sys.stderr.write("Compression using decoding costs is only available "
+                             "with the output window mode.\n")
+            sys.exit(1)
+        import json
+        costs = json.load(open(costs_path))
+        offset_bits = costs["offset_bits"]
+
+    # Use - to read from standard input or write to standard output, sending
+    # information to standard error if standard output is used for data.
+    command = args[1]
+    if args[2] == "-":
+        in_f = sys.stdin.buffer
+    else:
+        in_f = open(args[2], "rb")
+
+    if args[3] == "-":
+        out_f = sys.stdout.buffer
+        info = sys.stderr
+    else:
+        out_f = open(args[3], "wb")
+        info = sys.stdout
+
+    if command == "--compress" and auto:
+
+        data = in_f.read()
+        print("Input size:", len(data), file = info)
+
+        c, results = auto_compress(data)
+        print("Bits  Window      Parse    Transforms   Size  Literals  "
+              "References  Copied", file = info)
+
+        for (offset_bits, mode, optimal, transforms), r, tokens in results:
+            if r is None:
+                continue
+            literals, escapes, near, far, copied = tokens
+            print("%-5i %-11s %-8s %-10s %6i  %8i  %10i  %6i" % (
+                offset_bits, mode, ["greedy", "optimal"][optimal],
+                ",".join(transforms) or "-", len(r), literals + escapes,
+                near + far, copied), file = info)
+
+        offset_bits, mode, transforms, size = read_header(c)
+        print("Using %i bits for offsets with the %s window and transforms: %s" % (
+              offset_bits, mode, ",".join(transforms) or "none"), file = info)
+        print("Compressed:", len(c), file = info)
+        out_f.write(c)
+
+    elif command == "--compress":
+
+        print("Using %i bits for offsets." % offset_bits, file = info)
+
+        data = in_f.read()
+        print("Input size:", len(data), file = info)
+        original_data = data
+        data = apply_transforms(chain, data)
+
+        if use_blocks:
+            c = compress_blocks(data, block_size, offset_bits = offset_bits,
+                                window = mode, optimal = optimal)
+        elif optimal:
+            c = compress_optimal(data, offset_bits = offset_bits)
+        elif costs_path:
+            c = compress_costed(data, costs, offset_bits = offset_bits,
+                                budget = budget)
+            print("Predicted decoding cost:", decode_cost(c, costs), file = info)
+            if budget is not None and len(c) > budget:
+                sys.stderr.write("Warning: the compressed data (%i bytes) is larger "
+                                 "than the budget of %i bytes.\n" % (len(c), budget))
+        else:
+            c = compress(data, offset_bits = offset_bits, window = mode)
+        print("Compressed:", len(c), file = info)
+        out_f.write(c)
+
+        if use_blocks:
+            d = decompress_blocks(c, offset_bits = offset_bits, window = mode)
+        else:
+            d = decompress(c, offset_bits = offset_bits, window = mode)
+
+        if chain:
+            d = invert_transforms(chain, d)
             data = original_data
 
-        if data != d:
+        if data != d and use_blocks:
+            print("Data compressed incorrectly.", file = info)
+
+        elif data != d:
             i = 0
             while i < len(data) and i < len(d) and data[i] == d[i]:
                 i += 1
 
-            print("Data at %i compressed incorrectly." % i)
-            hexdump(data[:i])
-            print()
-            c, d = decompress(c, offset_bits = offset_bits, window = mode, stop_at = i)
-            hexdump(c[:i + 3])
+            print("Data at %i compressed incorrectly." % i, file = info)
+            hexdump(data[:i], info)
+            print(file = info)
+
+            # Find the compressed data that produced the incorrect output.
+            decompressor = Decompressor(offset_bits, mode)
+            j = 0
+            while j < len(c) and decompressor.produced <= i:
+                decompressor.feed(c[j:j + 1])
+                j += 1
+            hexdump(c[:j + 3], info)
 
     else:
-        print("Input size:", len(data))
-        d = decompress(data, offset_bits = offset_bits, window = mode)
-        if do_merge:
-            d = unmerge(d)
-        print("Decompressed:", len(d))
-        out_f.write(bytes(d))
+        # Read the parameters from the header if the input has one. Its magic
+        # value cannot occur at the start of data without a header.
+        first = in_f.read(65536)
+        try:
+            header = read_header(first)
+        except ValueError as e:
+            sys.stderr.write(str(e) + "\n")
+            sys.exit(1)
+        if header:
+            offset_bits, mode, transforms, size = header
+            chain = transforms
+            first = first[size:]
+
+        print("Using %i bits for offsets." % offset_bits, file = info)
+
+        if use_blocks:
+            data = first + in_f.read()
+            print("Input size:", len(data), file = info)
+            if block_number is None:
+                d = decompress_blocks(data, offset_bits = offset_bits, window = mode)
+            else:
+                try:
+                    d = decompress_block(data, block_number, offset_bits = offset_bits,
+                                         window = mode)
+                except ValueError as e:
+                    sys.stderr.write(str(e) + "\n")
+                    sys.exit(1)
+            print("Decompressed:", len(d), file = info)
+            out_f.write(d)
+
+        elif chain:
+            # Transforms can only be inverted when all the data has been
+            # decompressed.
+            data = first + in_f.read()
+            print("Input size:", len(data), file = info)
+            d = decompress(data, offset_bits = offset_bits, window = mode)
+            d = invert_transforms(chain, d)
+            print("Decompressed:", len(d), file = info)
+            out_f.write(d)
+
+        else:
+            # Decompress the input in chunks, writing the output as it is produced.
+            chunks = itertools.chain([first], iter(lambda: in_f.read(65536), b""))
+            decompressor = Decompressor(offset_bits, mode)
+            for chunk in chunks:
+                out_f.write(decompressor.feed(chunk))
+            decompressor.close()
+
+            print("Input size:", decompressor.consumed, file = info)
+            print("Decompressed:", decompressor.produced, file = info)
 
+    out_f.flush()
     sys.exit()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+"""
+decodecosts.py - Measures the cost of decompressing data in the simulator.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from common import get_int, opt
+from compression.compress import compress, compress_costed, compress_optimal, \
+                                 decode_cost
+from runtests import programs_dir
+import assembler, simulator
+import contextlib, io, json, os, sys
+
+# The decompress.txt program only supports 4 bits for offsets. It keeps the
+# source, destination and end addresses in these pairs of registers.
+offset_bits = 4
+src_register = 12
+dest_register = 2
+end_register = 14
+
+# The address that compressed data is placed at, followed by the output.
+data_addr = 0x100
+
+def usage(args):
+    sys.stderr.write("usage: %s [-o <cost file>] [-b <size budget>[%%]] "
+                     "[<data file>...]\n" % sys.argv[0])
+    sys.exit(1)
+
+def prepare():
+
+    # Assemble the decompression program and run the instructions at the start
+    # that set up its registers, returning a snapshot of the machine and the
+    # number of instructions executed.
+    lines = open(os.path.join(programs_dir, "decompress.txt")).readlines()
+    with contextlib.redirect_stdout(io.StringIO()):
+        code = assembler.assemble(lines)
+    if len(code) >= data_addr:
+        raise ValueError("The decompression program overlaps its data.")
+
+    start = 0
+    while code[start] & 0x0f == 0:
+        start += 2
+
+    simulator.load(code)
+    simulator.run_to(start)
+    return simulator.snapshot(), simulator.steps
+
+def run(snap, compressed, length):
+
+    # Decompress the data from the snapshot, returning the number of
+    # instructions executed and the decompressed data.
+    dest = data_addr + len(compressed)
+    end = dest + length
+    if end > 0x10000:
+        raise ValueError("The data is too large to decompress in memory.")
+
+    simulator.restore(snap)
+    simulator.write(data_addr, compressed)
+    for register, value in ((src_register, data_addr), (dest_register, dest),
+                            (end_register, end)):
+        simulator.stack[simulator.sp + register] = value & 0xff
+        simulator.stack[simulator.sp + register + 1] = value >> 8
+
+    simulator.engines["fast"]()
+    return simulator.steps, bytes(simulator.data[dest:end])
+
+def measure_costs(snap, prologue):
+
+    # Measure the cost of each kind of token by decompressing a literal
+    # followed by the token and subtracting the cost of the literal alone.
+    special = 0xff
+
+    def steps(tokens, length):
+        return run(snap, bytes([special]) + b"a" + tokens, 1 + length)[0]
+
+    one = steps(b"", 0)
+    literal = steps(b"a", 1) - one
+    max_length = (1 << (7 - offset_bits)) + 2
+
+    return {
+        "offset_bits": offset_bits,
+        "base": prologue + one - literal,
+        "literal": literal,
+        "escape": steps(bytes([special, 0]), 1) - one,
+        "near": [None] * 3 + [steps(bytes([special, ((n - 3) << offset_bits) | 1]), n) - one
+                              for n in range(3, max_length + 1)],
+        "far": [None] * 4 + [steps(bytes([special, 0x80, n - 4]), n) - one
+                             for n in range(4, 260)]
+        }
+
+def describe(costs):
+
+    far = costs["far"]
+    print("Instructions executed to decode each token:")
+    print("  fixed cost   %i" % costs["base"])
+    print("  literal      %i" % costs["literal"])
+    print("  escape       %i" % costs["escape"])
+    for n in range(3, len(costs["near"])):
+        print("  near %-3i     %i" % (n, costs["near"][n]))
+    print("  far 4        %i" % far[4])
+    print("  far 5-259    %i + %i per byte" % (far[5] - (far[6] - far[5]) * 5,
+                                               far[6] - far[5]))
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    o, cost_path = opt(args, "-o", 1, [""])
+    b, budget_text = opt(args, "-b", 1, [""])
+
+    try:
+        snap, prologue = prepare()
+        costs = measure_costs(snap, prologue)
+    except ValueError as e:
+        sys.stderr.write(str(e) + "\n")
+        sys.exit(1)
+
+    describe(costs)
+
+    if o:
+        f = open(cost_path, "w")
+        json.dump(costs, f)
+        f.close()
+
+    failed = False
+
+    for path in args[1:]:
+
+        data = open(path, "rb").read()
+        smallest = compress_optimal(data, offset_bits)
+
+        encodings = [("greedy", compress(data, offset_bits)),
+                     ("smallest", smallest),
+                     ("fastest", compress_costed(data, costs, offset_bits))]
+
+        if b:
+            if budget_text.endswith("%"):
+                budget = int(len(smallest) * (1 + float(budget_text[:-1]) / 100))
+            else:
+                budget = get_int(budget_text)
+            encodings.append(("budget %i" % budget,
+                              compress_costed(data, costs, offset_bits, budget)))
+
+        print()
+        print("%s: %i bytes" % (path, len(data)))
+        print("Encoding        Size   Predicted    Measured")
+
+        for name, compressed in encodings:
+            try:
+                measured, output = run(snap, compressed, len(data))
+            except ValueError as e:
+                sys.stderr.write(str(e) + "\n")
+                sys.exit(1)
+
+            if output != data:
+                print("%s encoding decompressed incorrectly." % name)
+                failed = True
+
+            print("%-12s %7i %11i %11i" % (name, len(compressed),
+                  decode_cost(compressed, costs), prologue + measured))
+
+    if failed:
+        sys.exit(1)
+
+    sys.exit()
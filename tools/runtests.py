@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+"""
+runtests.py - Assembles, runs and checks the test programs.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from common import get_int, opt
+import assembler, simulator
+from compression.compress import compress
+import contextlib, hashlib, io, multiprocessing, os, sys, tempfile, time
+
+tests_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tests")
+programs_dir = os.path.join(tests_dir, "programs")
+data_dir = os.path.join(tests_dir, "data")
+cache_dir = os.path.join(tempfile.gettempdir(), "shorthand-cache")
+# Include the assembler itself in the cache key so that changes to it cause
+# programs to be reassembled.
+assembler_hash = hashlib.sha1(open(assembler.__file__, "rb").read()).digest()
+
+def usage(args):
+    sys.stderr.write("usage: %s [-v] [-j <processes>] [-C <cache directory>] "
+                     "[<test name>...]\n" % sys.argv[0])
+    sys.exit(1)
+
+def find_tests(names):
+
+    # Each program in the programs directory is a test. Expected results are
+    # described in a file with the same name and an .expected suffix in the
+    # data directory.
+    tests = []
+    for name in sorted(os.listdir(programs_dir)):
+        stem, suffix = os.path.splitext(name)
+        if suffix == ".txt" and (not names or stem in names):
+            tests.append(stem)
+    return tests
+
+def read_spec(name):
+
+    # Read the expected results for a test, returning a list of commands,
+    # each of which is a list of words.
+    spec = []
+    path = os.path.join(data_dir, name + ".expected")
+    if not os.path.exists(path):
+        return spec
+
+    for line in open(path).readlines():
+        at = line.find("#")
+        if at != -1: line = line[:at]
+        pieces = line.split()
+        if pieces:
+            spec.append(pieces)
+
+    return spec
+
+def read_data(name):
+    return open(os.path.join(data_dir, name), "rb").read()
+
+def assemble(source, base):
+
+    # Return cached bytecode for the source if possible; otherwise assemble
+    # it and cache the result. Sources that include files are not cached
+    # because the key does not cover the files they include.
+    lines = source.decode("latin1").splitlines(True)
+    if b".incbin" in source:
+        return assembler.assemble(lines, base, directory=programs_dir)
+
+    key = hashlib.sha1(assembler_hash + b"%i\n" % base + source).hexdigest()
+    path = os.path.join(cache_dir, key + ".bin")
+    try:
+        return open(path, "rb").read()
+    except IOError:
+        pass
+
+    code = assembler.assemble(lines, base)
+
+    # Write the cached file atomically in case other workers are assembling
+    # the same source.
+    os.makedirs(cache_dir, exist_ok=True)
+    f = tempfile.NamedTemporaryFile(dir=cache_dir, delete=False)
+    f.write(code)
+    f.close()
+    os.replace(f.name, path)
+
+    return code
+
+def set_cache_dir(path):
+    global cache_dir
+    cache_dir = path
+
+def run_test(name):
+
+    start = time.perf_counter()
+    spec = read_spec(name)
+    commands = set(pieces[0] for pieces in spec)
+    source = open(os.path.join(programs_dir, name + ".txt"), "rb").read()
+
+    base = 0
+    preloads = []
+    engine = "fast"
+    for pieces in spec:
+        if pieces[0] == "base":
+            base = get_int(pieces[1])
+        elif pieces[0] == "engine":
+            engine = pieces[1]
+        elif pieces[0] == "data":
+            preloads.append((get_int(pieces[1]), read_data(pieces[2])))
+        elif pieces[0] == "compressed":
+            values = read_data(pieces[2])
+            preloads.append((get_int(pieces[1]),
+                             bytes(compress(values, offset_bits = get_int(pieces[3])))))
+
+    messages = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(messages):
+            code = assemble(source, base)
+    except SystemExit:
+        if "error" in commands:
+            return name, True, "failed to assemble as expected", time.perf_counter() - start
+        return name, False, messages.getvalue().strip(), time.perf_counter() - start
+    except Exception as e:
+        return name, False, "assembler raised %r" % e, time.perf_counter() - start
+
+    if "error" in commands:
+        return name, False, "assembled unexpectedly", time.perf_counter() - start
+    elif "norun" in commands:
+        return name, True, "", time.perf_counter() - start
+
+    output = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(output):
+            simulator.load(code, base, preloads)
+            simulator.engines[engine]()
+    except IndexError:
+        return name, False, "ran outside memory", time.perf_counter() - start
+    except Exception as e:
+        return name, False, "simulator raised %r" % e, time.perf_counter() - start
+
+    failures = []
+    for pieces in spec:
+        if pieces[0] == "registers":
+            expected = list(map(get_int, pieces[1:]))
+            found = simulator.stack[simulator.sp:simulator.sp + len(expected)]
+            if found != expected:
+                failures.append("registers %s != %s" % (found, expected))
+
+        elif pieces[0] == "memory":
+            addr = get_int(pieces[1])
+            expected = read_data(pieces[2])
+            found = bytes(simulator.data[addr:addr + len(expected)])
+            if found != expected:
+                failures.append("memory at %i differs from %s" % (addr, pieces[2]))
+
+    return name, not failures, "; ".join(failures), time.perf_counter() - start
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    verbose = opt(args, "-v")
+    j, processes = opt(args, "-j", 1, [str(os.cpu_count() or 1)])
+    c, cache_dir = opt(args, "-C", 1, [cache_dir])
+
+    tests = find_tests(args[1:])
+    if not tests:
+        usage(args)
+
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(get_int(processes), set_cache_dir, (cache_dir,))
+    failed = 0
+
+    for name, passed, message, elapsed in pool.imap(run_test, tests):
+        if not passed:
+            failed += 1
+        if passed and not verbose:
+            message = ""
+        line = "%s %-16s %8.2f ms  %s" % (["FAIL", "PASS"][passed], name,
+                                          elapsed * 1000, message)
+        print(line.rstrip())
+
+    pool.close()
+    pool.join()
+
+    print("%i passed, %i failed in %.2f s" % (len(tests) - failed, failed,
+                                             time.perf_counter() - start))
+
+    if failed:
+        sys.exit(1)
+
+    sys.exit()
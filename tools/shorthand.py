@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+"""
+shorthand.py - A single entry point for the assembler, compressor and simulator.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+# Only modules needed by the command being run are imported, so that the
+# tool starts quickly.
+import os, sys
+
+tools_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Commands that run other tools, as if they were run on their own.
+tools = {
+    "assemble": "assembler.py",
+    "simulate": "simulator.py",
+    "compress": os.path.join("compression", "compress.py")
+    }
+
+def usage(args):
+    sys.stderr.write(
+        "usage: %s <command> [<arguments>]\n\n"
+        "Commands:\n"
+        "  assemble   run the assembler\n"
+        "  simulate   run the simulator\n"
+        "  compress   run the compression tool\n"
+        "  run [-b <base address>] [-e <engine>] [-x <address> <length>]\n"
+        "      [--data <data file>] [--data-address <address>]\n"
+        "      [--compress-data] [--bits <offset bits>] <source file>\n"
+        "             assemble and run a program, loading data into memory\n"
+        % sys.argv[0])
+    sys.exit(1)
+
+def run_tool(name, args):
+
+    # Run the tool's main program in this process with the remaining
+    # arguments.
+    import runpy
+    path = os.path.join(tools_dir, tools[name])
+    sys.argv = [path] + args
+    runpy.run_path(path, run_name="__main__")
+
+def run(args):
+
+    from common import get_int, opt
+    import assembler, simulator
+
+    args = [sys.argv[0]] + args
+    base, base_v = opt(args, "-b", 1, ["0"])
+    e, engine = opt(args, "-e", 1, ["fast"])
+    extract, (ex_addr, ex_length) = opt(args, "-x", 2, ["0", "0"])
+    d, data_file = opt(args, "--data", 1, [""])
+    da, data_addr = opt(args, "--data-address", 1, ["0x2000"])
+    compress_data = opt(args, "--compress-data")
+    b, bits = opt(args, "--bits", 1, ["4"])
+
+    if engine not in simulator.engines:
+        sys.stderr.write("Unknown engine '%s'. Available engines: %s\n" % (
+                         engine, ", ".join(sorted(simulator.engines))))
+        sys.exit(1)
+
+    if len(args) != 2:
+        usage(args)
+
+    base_addr = get_int(base_v)
+    code = assembler.assemble(open(args[1]).readlines(), base_addr,
+                              directory=os.path.dirname(args[1]))
+
+    preloads = []
+    if d:
+        values = open(data_file, "rb").read()
+        if compress_data:
+            from compression.compress import compress
+            values = compress(values, get_int(bits))
+        preloads.append((get_int(data_addr), values))
+
+    simulator.load(code, base_addr, preloads)
+    simulator.engines[engine]()
+    print(simulator.stack[simulator.sp:])
+    if engine == "memo":
+        simulator.describe_memo()
+
+    if extract:
+        simulator.extract = True
+        simulator.ex_addr = get_int(ex_addr)
+        simulator.ex_length = get_int(ex_length)
+        simulator.process_command("x")
+        simulator.process_command("tx")
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[:]
+    if len(args) < 2:
+        usage(args)
+
+    command = args[1]
+    if command in tools:
+        run_tool(command, args[2:])
+    elif command == "run":
+        run(args[2:])
+    else:
+        usage(args)
+
+    sys.exit()
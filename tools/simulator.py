@@ -20,7 +20,8 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from common import get_int, opt
-import sys
+from symbols import load_map
+import collections, sys
 
 # Reserve memory for variables and a return address stack.
 stack = [0] * 128
@@ -33,30 +34,164 @@ pc = 0
 # Carry/borrow
 cb = False
 breakpoints = set()
+symbols = None
+data = []
+single = verbose = extract = False
+# The number of instructions executed by the last run.
+steps = 0
+# The instructions skipped by the memo engine during the last run.
+memo_steps = 0
 
 def usage(args):
     sys.stderr.write("usage: %s [-c] [-v] [-b <base address>] "
                      "[-d <data address> <data file>] "
-                     "[-x <address> <length>] [-s] "
+                     "[-x <address> <length>] [-s] [-m <map file>] "
+                     "[-e <engine>] [-a <access file>] "
                      "<input file>\n" % sys.argv[0])
     sys.exit(1)
 
 def process():
-    global pc
+    global pc, steps
 
-    pc = base_addr
+    steps = 0
+    table = instruction_table()
     while not end:
         opcode = data[pc]
-        inst = instructions[opcode & 0x0f]
+        inst = table[opcode & 0x0f]
         if single or verbose or pc in breakpoints:
-            print(pc, inst)
+            if symbols:
+                print(pc, symbols.describe(pc), inst)
+            else:
+                print(pc, inst)
             if single or pc in breakpoints:
                 print(stack[sp:sp + 16])
                 print(" ".join([("%02x" % x) for x in stack[sp:sp + 16]]))
                 process_command(input(">"))
         inst(opcode)
+        steps += 1
 
-    print(stack[sp:])
+def process_fast():
+    global pc, steps
+
+    # Run without tracing or breakpoints, keeping the memory, instruction
+    # table and instruction count in local variables.
+    memory = data
+    table = instruction_table()
+    count = 0
+    while not end:
+        opcode = memory[pc]
+        table[opcode & 0x0f](opcode)
+        count += 1
+    steps = count
+
+def load(code, base=0, preloads=()):
+
+    # Reset the machine, loading the code at the base address and each of the
+    # (address, bytes) pairs in the preloads sequence into memory. Programs
+    # start at the base address.
+    global base_addr, data, stack, rstack, sp, rsp, end, pc, cb, current
+
+    stack = [0] * 128
+    rstack = [0] * 8
+    sp = len(stack) - 16
+    rsp = len(rstack) - 1
+    end = False
+    cb = False
+    base_addr = pc = base
+
+    data = [0] * base
+    data += code
+    # Append a sys 0 (exit) call.
+    data.append(0x0f)
+    data += [0] * (65536 - len(data))
+
+    for addr, values in preloads:
+        data[addr:addr + len(values)] = values
+
+    current = None
+
+def run_to(addr):
+    global pc, steps
+
+    # Run the program until it reaches the instruction at the address or
+    # exits, so that a snapshot can be taken of the state at that point.
+    table = instruction_table()
+    steps = 0
+    while not end and pc != addr:
+        opcode = data[pc]
+        table[opcode & 0x0f](opcode)
+        steps += 1
+
+# Snapshots record the state of the machine so that it can be restored
+# later. The memory pages written since the current snapshot was taken or
+# restored are recorded while it is current, so that restoring it only
+# copies those pages.
+page_size = 256
+current = None
+
+class Snapshot:
+
+    def __init__(self):
+        self.data = data
+        self.memory = data[:]
+        self.stack = stack[:]
+        self.rstack = rstack[:]
+        self.sp, self.rsp, self.pc, self.cb, self.end = sp, rsp, pc, cb, end
+        self.dirty = set()
+
+def snapshot():
+    global current
+
+    # Return a snapshot of the current state, making it the current one.
+    current = Snapshot()
+    return current
+
+def restore(snap):
+    global data, stack, rstack, sp, rsp, pc, cb, end, current
+
+    if snap is current and data is snap.data:
+        for page in snap.dirty:
+            addr = page * page_size
+            data[addr:addr + page_size] = snap.memory[addr:addr + page_size]
+    else:
+        # Memory was replaced or written while tracking another snapshot.
+        data = snap.data
+        data[:] = snap.memory
+
+    snap.dirty.clear()
+    current = snap
+    stack[:] = snap.stack
+    rstack[:] = snap.rstack
+    sp, rsp, pc, cb, end = snap.sp, snap.rsp, snap.pc, snap.cb, snap.end
+
+def mark(addr, length):
+
+    # Record the pages in the region as written for the current snapshot.
+    if current is not None and length > 0:
+        current.dirty.update(range(addr // page_size,
+                                   (addr + length - 1) // page_size + 1))
+
+def write(addr, values):
+
+    # Write the values into memory at the address, recording the pages
+    # written for the current snapshot.
+    mark(addr, len(values))
+    data[addr:addr + len(values)] = values
+
+def sweep(snap, variants, result, engine="fast"):
+
+    # Run the program from the snapshot once for each of the variants, which
+    # are sequences of (address, bytes) pairs to write into memory before
+    # each run, returning a list of the values returned by the result
+    # function after each run.
+    results = []
+    for preloads in variants:
+        restore(snap)
+        for addr, values in preloads:
+            write(addr, values)
+        engines[engine]()
+        results.append(result())
+    return results
 
 def process_command(t):
     global end, single
@@ -77,9 +212,11 @@ def process_command(t):
     elif t == "q": end = True
     elif t == "c": single = False
     elif t.startswith("b"):
-        addr = t[1:].rstrip()
+        addr = t[1:].strip()
         if not addr:
             addr = pc
+        elif symbols and not addr.isdigit():
+            addr = symbols.address(addr)
         else:
             addr = int(addr)
         breakpoints.add(addr)
@@ -179,7 +316,7 @@ def inst_not():
 
     args = data[pc + 1]
     dest, src = args & 0x0f, args >> 4
-    stack[sp + dest] = ~stack[sp + src]
+    stack[sp + dest] = ~stack[sp + src] & 0xff
     pc += 2
 
 def inst_ld(opcode):
@@ -206,25 +343,28 @@ def inst_bx(opcode):
     global pc
 
     cond = opcode >> 4
-    offset = data[pc + 1]
-    flags = 0
     if cond == 0:
         inst_not()
         return
-    elif cond < 7:
-        args = data[pc + 2]
-        first, second = args & 0x0f, args >> 4
+    elif branch_taken(cond):
+        offset = data[pc + 1]
         if offset >= 128: offset -= 256
-        v = stack[sp + first] - stack[sp + second]
-        if v < 0: flags = 1
-        elif v == 0: flags = 2
-        elif v > 0: flags = 4
-
-    if flags & cond != 0 or cond == 7:
         pc += offset
     else:
         pc += 3
 
+def branch_taken(cond):
+
+    # Return whether the branch at pc with the given condition is taken.
+    if cond == 7:
+        return True
+    args = data[pc + 2]
+    v = stack[sp + (args & 0x0f)] - stack[sp + (args >> 4)]
+    if v < 0: flags = 1
+    elif v == 0: flags = 2
+    else: flags = 4
+    return flags & cond != 0
+
 def inst_js(opcode):
     global pc, rsp, sp
 
@@ -256,16 +396,104 @@ def inst_ret(opcode):
     pc = rstack[rsp]
 
 def inst_sys(opcode):
-    global end, pc
+    global cb, end, pc
     n = opcode >> 4
     if n == 0:
         end = True
     elif n == 1:
         print(chr(stack[sp]), end="")
+    elif 2 <= n <= 5:
+        # Bulk memory operations take a value or source address in r0 and r1,
+        # a destination address in r2 and r3, and a length or end address in
+        # r4 and r5.
+        src = stack[sp] | (stack[sp + 1] << 8)
+        dest = stack[sp + 2] | (stack[sp + 3] << 8)
+        length = stack[sp + 4] | (stack[sp + 5] << 8)
+        if n == 2:
+            copy_forward(src, dest, length)
+        elif n == 3:
+            check_range(dest, length)
+            data[dest:dest + length] = [stack[sp]] * length
+        elif n == 4:
+            stack[sp + 6], cb = compare_memory(src, dest, length)
+        else:
+            src = decompress_region(src, dest, length, stack[sp + 6])
+            stack[sp], stack[sp + 1] = src & 0xff, src >> 8
     elif n == 15:
         print(stack[sp:])
     pc += 1
 
+def check_range(addr, length):
+    if addr + length > len(data):
+        raise IndexError("memory access beyond the end of memory")
+
+def copy_forward(src, dest, length):
+
+    # Copy bytes as a loop that copies them one at a time in ascending order
+    # would, repeating earlier bytes if the destination overlaps the source.
+    check_range(src, length)
+    check_range(dest, length)
+    if src < dest < src + length:
+        pattern = data[src:dest]
+        data[dest:dest + length] = (pattern * (length // len(pattern) + 1))[:length]
+    else:
+        data[dest:dest + length] = data[src:src + length]
+
+def compare_memory(first, second, length):
+
+    # Return the result of comparing two regions of memory and whether the
+    # first is less than the second, as the sub instruction sets the carry.
+    check_range(first, length)
+    check_range(second, length)
+    a = data[first:first + length]
+    b = data[second:second + length]
+    if a == b:
+        return 0, False
+    elif a < b:
+        return 255, True
+    else:
+        return 1, False
+
+def decompress_region(src, dest, end, offset_bits):
+
+    # Decompress data compressed using the output window, as the
+    # decompress.txt test program does, returning the address after the
+    # compressed data.
+    special = data[src]
+    src += 1
+    mask = (1 << offset_bits) - 1
+
+    while dest < end:
+        v = data[src]
+        if v != special:
+            # Copy literals up to the next special byte in one operation.
+            try:
+                stop = data.index(special, src, src + end - dest)
+            except ValueError:
+                stop = src + end - dest
+            data[dest:dest + stop - src] = data[src:stop]
+            dest += stop - src
+            src = stop
+            continue
+
+        offset = data[src + 1]
+        if offset == 0:
+            data[dest] = special
+            dest += 1
+            src += 2
+        elif offset < 0x80:
+            count = (offset >> offset_bits) + 3
+            copy_forward(dest - (offset & mask), dest, count)
+            dest += count
+            src += 2
+        else:
+            count = data[src + 2] + 4
+            copy_forward(dest - (offset & 0x7f) - 1, dest, count)
+            dest += count
+            src += 3
+
+    return src
+
 instructions = [
     inst_lc,        # R(dest)   V(low)      V(high)
     inst_cpy,       # R(dest)   R(src)      V(shift)
@@ -287,6 +515,430 @@ instructions = [
     inst_sys        # V(value)
     ]
 
+# Functions called when events occur, indexed by event name. Each function is
+# passed the address of the instruction that caused the event, followed by
+# these values:
+#
+# call      target address, number of registers reserved
+# return    return address, number of registers released
+# load      memory address, value loaded
+# store     memory address, value stored
+# sys       system call number
+# branch    target address (only called when a branch is taken)
+hooks = {"call": [], "return": [], "load": [], "store": [], "sys": [],
+         "branch": []}
+
+def add_hook(event, fn):
+    if event not in hooks:
+        raise ValueError("Unknown event '%s'." % event)
+    hooks[event].append(fn)
+
+def remove_hook(event, fn):
+    hooks[event].remove(fn)
+
+def hooked_ld(opcode):
+    at = pc
+    args = data[pc + 1]
+    addr = stack[sp + (args & 0x0f)] | (stack[sp + (args >> 4)] << 8)
+    inst_ld(opcode)
+    for fn in hooks["load"]:
+        fn(at, addr, data[addr])
+
+def hooked_st(opcode):
+    at = pc
+    args = data[pc + 1]
+    addr = stack[sp + (args & 0x0f)] | (stack[sp + (args >> 4)] << 8)
+    inst_st(opcode)
+    for fn in hooks["store"]:
+        fn(at, addr, data[addr])
+
+def hooked_bx(opcode):
+    at = pc
+    cond = opcode >> 4
+    # The not instruction shares the opcode but is not a branch.
+    taken = cond != 0 and branch_taken(cond)
+    inst_bx(opcode)
+    if taken:
+        for fn in hooks["branch"]:
+            fn(at, pc)
+
+def hooked_js(opcode):
+    at = pc
+    inst_js(opcode)
+    for fn in hooks["call"]:
+        fn(at, pc, opcode >> 4)
+
+def hooked_jss(opcode):
+    at = pc
+    inst_jss(opcode)
+    for fn in hooks["call"]:
+        fn(at, pc, opcode >> 4)
+
+def hooked_ret(opcode):
+    at = pc
+    inst_ret(opcode)
+    for fn in hooks["return"]:
+        fn(at, pc, opcode >> 4)
+
+def hooked_sys(opcode):
+    at = pc
+    inst_sys(opcode)
+    for fn in hooks["sys"]:
+        fn(at, opcode >> 4)
+
+# The instructions that are replaced when hooks are registered for events.
+hooked_instructions = {
+    "load": [(7, hooked_ld)],
+    "store": [(8, hooked_st)],
+    "branch": [(9, hooked_bx)],
+    "call": [(12, hooked_js), (13, hooked_jss)],
+    "return": [(14, hooked_ret)],
+    "sys": [(15, hooked_sys)]
+    }
+
+def instruction_table():
+
+    # Return the instruction table for a run, replacing only the instructions
+    # that generate events with registered hooks, so that runs without hooks
+    # use the plain instructions. Instructions that write to memory are also
+    # replaced while there is a current snapshot.
+    table = instructions
+    for event, replacements in hooked_instructions.items():
+        if hooks[event]:
+            if table is instructions:
+                table = instructions[:]
+            for index, inst in replacements:
+                table[index] = inst
+
+    if current is not None:
+        table = table[:]
+        table[8] = tracked(table[8], mark_store)
+        table[15] = tracked(table[15], mark_sys)
+    return table
+
+def tracked(inst, marker):
+
+    # Return a function that records the pages written by the instruction
+    # before performing it.
+    def tracked_inst(opcode):
+        marker(opcode)
+        inst(opcode)
+    return tracked_inst
+
+def mark_store(opcode):
+    args = data[pc + 1]
+    mark(stack[sp + (args & 0x0f)] | (stack[sp + (args >> 4)] << 8), 1)
+
+def mark_sys(opcode):
+    region = sys_region(opcode)
+    if region:
+        mark(*region)
+
+def sys_region(opcode):
+
+    # Return the address and length of the memory written by a system call,
+    # or None if it does not write to memory.
+    n = opcode >> 4
+    if 2 <= n <= 5 and n != 4:
+        dest = stack[sp + 2] | (stack[sp + 3] << 8)
+        length = stack[sp + 4] | (stack[sp + 5] << 8)
+        if n == 5:
+            # The decompress call takes an end address, but a reference that
+            # ends the data is copied in full, as the 6502 decoder does, so it
+            # can write up to 258 bytes beyond it.
+            length = min(length - dest + 258, len(data) - dest)
+        return dest, length
+    return None
+
+# Memoisation of calls to pure subroutines by the memo engine. Subroutines
+# that only use registers and load from memory have their results cached for
+# each set of input values, up to this many results for each subroutine.
+memo_size = 256
+# Statistics for the last run with the memo engine.
+memo_stats = {}
+# The subroutines found by the memo engine, indexed by address, with None
+# for those that cannot be memoised, and the subroutines that have loaded
+# from or are stored in each page of memory.
+routines = {}
+readers = {}
+# Subroutines longer than this are not analysed.
+max_routine = 256
+
+class Routine:
+
+    # A pure subroutine and the results of calls to it.
+    def __init__(self, addr, args, reads, writes, uses_cb, sets_cb, pages):
+        self.addr = addr
+        self.args = args
+        # The registers read before they are written and the registers
+        # written, relative to the subroutine's registers.
+        self.reads = reads
+        self.writes = writes
+        self.uses_cb = uses_cb
+        self.sets_cb = sets_cb
+        self.code_pages = set(pages)
+        self.pages = set()
+        self.results = collections.OrderedDict()
+        for page in pages:
+            self.read_page(page)
+
+    def read_page(self, page):
+        if page not in self.pages:
+            self.pages.add(page)
+            readers.setdefault(page, set()).add(self)
+
+def decode_routine_inst(addr):
+
+    # Return the registers read and written by the instruction at the given
+    # address, whether it reads and writes the carry flag, the addresses of
+    # the instructions that can follow it, and the number of registers
+    # released by a ret instruction. Return None for instructions that are
+    # not allowed in pure subroutines.
+    if addr + 3 > len(data):
+        return None
+    opcode = data[addr]
+    n, high = opcode & 0x0f, opcode >> 4
+    args = data[addr + 1]
+    first, second = args & 0x0f, args >> 4
+
+    if n == 0:
+        return (), (high,), False, False, [addr + 2], None
+    elif n == 1:
+        return (first,), (high,), False, False, [addr + 2], None
+    elif n in (2, 3):
+        return (first, second), (high,), False, True, [addr + 2], None
+    elif n in (4, 5, 6, 7):
+        return (first, second), (high,), False, False, [addr + 2], None
+    elif n == 9:
+        if high == 0:
+            return (second,), (first,), False, False, [addr + 2], None
+        offset = args - 256 if args >= 128 else args
+        if high == 7:
+            return (), (), False, False, [addr + offset], None
+        operands = data[addr + 2]
+        return ((operands & 0x0f, operands >> 4), (), False, False,
+                [addr + 3, addr + offset], None)
+    elif n in (10, 11):
+        return (high,), (high,), True, True, [addr + 1], None
+    elif n == 14:
+        return (), (), False, False, [], high
+
+    # Stores, calls and system calls have effects that are not cached.
+    return None
+
+def analyse_routine(addr, args):
+
+    # Return a Routine for the subroutine at the given address if it only
+    # uses registers and loads from memory, or None if it cannot be memoised.
+    # The registers that are definitely written on every path to each
+    # instruction are found, so that registers that are only read after they
+    # are written are not treated as inputs.
+    decoded = {}
+    written = {addr: (frozenset(), False)}
+    pending = [addr]
+    reads = set()
+    writes = set()
+    uses_cb = sets_cb = False
+
+    while pending:
+        at = pending.pop()
+        if at not in decoded:
+            if len(decoded) == max_routine:
+                return None
+            decoded[at] = decode_routine_inst(at)
+            if decoded[at] is None:
+                return None
+
+        inst_reads, inst_writes, inst_uses_cb, inst_sets_cb, following, released = decoded[at]
+        if released is not None and released != args:
+            return None
+
+        done, cb_done = written[at]
+        reads.update(r for r in inst_reads if r not in done)
+        writes.update(inst_writes)
+        uses_cb = uses_cb or (inst_uses_cb and not cb_done)
+        sets_cb = sets_cb or inst_sets_cb
+
+        done = done | frozenset(inst_writes)
+        cb_done = cb_done or inst_sets_cb
+        for next_at in following:
+            if next_at in written:
+                previous, previous_cb = written[next_at]
+                state = (previous & done, previous_cb and cb_done)
+                if state == written[next_at]:
+                    continue
+            else:
+                state = (done, cb_done)
+            written[next_at] = state
+            pending.append(next_at)
+
+    # Registers and the carry flag that are only written on some paths are
+    # left unchanged on others, so their values before the call are also
+    # inputs. Otherwise, results would restore values from earlier calls.
+    returns = [written[at] for at in decoded if decoded[at][5] is not None]
+    always = frozenset(writes)
+    cb_always = True
+    for done, cb_done in returns:
+        always &= done
+        cb_always = cb_always and cb_done
+    reads.update(writes - always)
+    uses_cb = uses_cb or (sets_cb and not cb_always)
+
+    # The subroutine's own instructions are treated as memory that it reads,
+    # so that its results are discarded if it is modified.
+    pages = set()
+    for at in decoded:
+        pages.update(range(at // page_size, (at + 2) // page_size + 1))
+
+    return Routine(addr, args, tuple(sorted(reads)), tuple(sorted(writes)),
+                   uses_cb, sets_cb, pages)
+
+def memo_call(opcode, target, following, call, table):
+    global cb, pc, memo_steps
+
+    # Find the subroutine, analysing it the first time it is called.
+    args = opcode >> 4
+    routine = routines.get(target, False)
+    if routine is False:
+        routine = routines[target] = analyse_routine(target, args)
+    if routine is None or routine.args != args:
+        memo_stats["uncached"] += 1
+        call(opcode)
+        return
+
+    base = sp - args
+    key = (tuple([stack[base + r] for r in routine.reads]),
+           routine.uses_cb and cb)
+    result = routine.results.get(key)
+
+    if result is not None:
+        # Write the results, leaving the return address on the return stack
+        # as the call would have done.
+        routine.results.move_to_end(key)
+        values, result_cb, count = result
+        for r, value in zip(routine.writes, values):
+            stack[base + r] = value
+        if routine.sets_cb:
+            cb = result_cb
+        rstack[rsp] = following
+        pc = following
+        memo_stats["hits"] += 1
+        memo_steps += count
+        return
+
+    # Perform the call and run the subroutine until it returns, recording the
+    # pages it loads from.
+    memo_stats["misses"] += 1
+    depth = rsp
+    call(opcode)
+    memory = data
+    count = 0
+    while rsp != depth:
+        opcode = memory[pc]
+        n = opcode & 0x0f
+        if n == 7:
+            args = memory[pc + 1]
+            routine.read_page((stack[sp + (args & 0x0f)] |
+                               (stack[sp + (args >> 4)] << 8)) // page_size)
+        table[n](opcode)
+        count += 1
+
+    routine.results[key] = (tuple([stack[base + r] for r in routine.writes]),
+                            cb, count)
+    if len(routine.results) > memo_size:
+        routine.results.popitem(last=False)
+    memo_steps += count
+
+def invalidate(addr, length):
+
+    # Discard the results of subroutines that load from the pages written.
+    if length <= 0:
+        return
+    for page in range(addr // page_size, (addr + length - 1) // page_size + 1):
+        for routine in readers.get(page, ()):
+            if routine.results:
+                routine.results.clear()
+                memo_stats["invalidations"] += 1
+            if page in routine.code_pages:
+                # Analyse the subroutine again when it is next called.
+                routines.pop(routine.addr, None)
+
+def memo_table():
+
+    # Return the instruction table for the memo engine, based on the table
+    # that the other engines would use.
+    table = instruction_table()
+    memo = table[:]
+    js, jss, st, sys_inst = table[12], table[13], table[8], table[15]
+
+    def memo_js(opcode):
+        memo_call(opcode, data[pc + 1] | (data[pc + 2] << 8), pc + 3, js,
+                  table)
+
+    def memo_jss(opcode):
+        offset = data[pc + 1]
+        if offset >= 128: offset -= 256
+        memo_call(opcode, pc + offset, pc + 2, jss, table)
+
+    def memo_st(opcode):
+        args = data[pc + 1]
+        invalidate(stack[sp + (args & 0x0f)] | (stack[sp + (args >> 4)] << 8), 1)
+        st(opcode)
+
+    def memo_sys(opcode):
+        region = sys_region(opcode)
+        if region:
+            invalidate(*region)
+        sys_inst(opcode)
+
+    memo[12], memo[13], memo[8], memo[15] = memo_js, memo_jss, memo_st, memo_sys
+    return memo
+
+def process_memo():
+    global steps, memo_steps
+
+    # Run like the fast engine, skipping calls to pure subroutines that have
+    # already been made with the same inputs. The instructions that would
+    # have been executed by those calls are included in the count.
+    routines.clear()
+    readers.clear()
+    memo_stats.clear()
+    memo_stats.update({"hits": 0, "misses": 0, "uncached": 0,
+                       "invalidations": 0})
+    memo_steps = 0
+
+    memory = data
+    table = memo_table()
+    count = 0
+    while not end:
+        opcode = memory[pc]
+        table[opcode & 0x0f](opcode)
+        count += 1
+    steps = count + memo_steps
+
+def describe_memo():
+
+    print("Memoised calls: %(hits)i hits, %(misses)i misses, %(uncached)i "
+          "uncached, %(invalidations)i invalidations" % memo_stats)
+    for addr in sorted(routines):
+        routine = routines[addr]
+        if symbols:
+            name = symbols.describe(addr)
+        else:
+            name = "%04x" % addr
+        if routine is None:
+            print("  %s: not pure" % name)
+        else:
+            print("  %s: %i results cached" % (name, len(routine.results)))
+
+# Engines that run the loaded program, indexed by name. The debug engine
+# supports tracing, single stepping and breakpoints.
+engines = {
+    "debug": process,
+    "fast": process_fast,
+    "memo": process_memo
+    }
+
 if __name__ == "__main__":
 
     args = sys.argv[:]
@@ -299,24 +951,41 @@ if __name__ == "__main__":
     extract, (ex_addr, ex_length) = opt(args, "-x", 2, ["0", "0"])
     ex_addr = get_int(ex_addr)
     ex_length = get_int(ex_length)
+    map_file, map_path = opt(args, "-m", 1, [""])
+    if map_file:
+        symbols = load_map(map_path)
+    e, engine = opt(args, "-e", 1, ["fast"])
+    a, access_path = opt(args, "-a", 1, [""])
+    if single or verbose:
+        engine = "debug"
+    if engine not in engines:
+        sys.stderr.write("Unknown engine '%s'. Available engines: %s\n" % (
+                         engine, ", ".join(sorted(engines))))
+        sys.exit(1)
 
     if len(args) != 2:
         usage(args)
 
     code = open(args[1], "rb").read()
-    data = [0] * base_addr
-    for c in code: data.append(c)
-    # Append a sys 0 (exit) call.
-    data.append(0x0f)
-    data += [0] * (65536 - len(data))
-
+    preloads = []
     if da:
-        data_addr = get_int(data_addr)
-        for x in open(data_file, "rb").read():
-            data[data_addr] = x
-            data_addr += 1
+        preloads.append((get_int(data_addr), open(data_file, "rb").read()))
+
+    if a:
+        import accesses
+        recorder = accesses.Recorder()
+        recorder.register(sys.modules[__name__])
+
+    load(code, base_addr, preloads)
+    engines[engine]()
+    print(stack[sp:])
+
+    if engine == "memo":
+        describe_memo()
 
-    process()
+    if a:
+        accesses.write_report(sys.stdout, recorder, symbols)
+        accesses.write_json(access_path, recorder)
 
     process_command("x")
     process_command("tx")
@@ -0,0 +1,122 @@
+"""
+symbols.py - Symbol maps and line tables for assembled programs.
+
+Copyright (C) 2023 David Boddie <david@boddie.org.uk>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from common import get_int
+import bisect
+
+# A map file is a text file containing one record on each line:
+#
+#   file <source file>
+#   label <address> <number of parameters> <name>
+#   const <address> <number of parameters> <name>
+#   line <address> <line number>
+#
+# Labels are defined in the program's code; constants are assigned absolute
+# addresses. Label, constant and line records are written in address order so
+# that they can be searched directly.
+
+def write_map(f, source, labels, line_table):
+
+    f.write("file %s\n" % source)
+
+    symbols = []
+    for name, (addr, nparams, absolute) in labels.items():
+        symbols.append((addr, absolute, nparams, name))
+    symbols.sort()
+
+    for addr, absolute, nparams, name in symbols:
+        if absolute:
+            kind = "const"
+        else:
+            kind = "label"
+        f.write("%s 0x%04x %i %s\n" % (kind, addr, nparams, name))
+
+    for addr, l in sorted(line_table):
+        f.write("line 0x%04x %i\n" % (addr, l))
+
+class SymbolMap:
+
+    def __init__(self, f):
+
+        self.source = ""
+        self.labels = {}
+        self.consts = {}
+        self.label_addrs = []
+        self.label_names = []
+        self.line_addrs = []
+        self.line_numbers = []
+
+        for line in f:
+            pieces = line.split()
+            if not pieces:
+                continue
+            kind = pieces[0]
+            if kind == "file":
+                self.source = line[len(kind):].strip()
+            elif kind == "label":
+                addr, nparams, name = get_int(pieces[1]), get_int(pieces[2]), pieces[3]
+                self.labels[name] = (addr, nparams)
+                self.label_addrs.append(addr)
+                self.label_names.append(name)
+            elif kind == "const":
+                addr, nparams, name = get_int(pieces[1]), get_int(pieces[2]), pieces[3]
+                self.consts[name] = (addr, nparams)
+            elif kind == "line":
+                self.line_addrs.append(get_int(pieces[1]))
+                self.line_numbers.append(get_int(pieces[2]))
+
+    def address(self, name):
+
+        if name in self.labels:
+            return self.labels[name][0]
+        return self.consts[name][0]
+
+    def label(self, pc):
+
+        # Find the nearest label at or before the given address.
+        i = bisect.bisect_right(self.label_addrs, pc) - 1
+        if i < 0:
+            return "0x%04x" % pc
+
+        offset = pc - self.label_addrs[i]
+        if offset == 0:
+            return self.label_names[i]
+        return "%s+%i" % (self.label_names[i], offset)
+
+    def line(self, pc):
+
+        # Only addresses where instructions begin have line numbers.
+        i = bisect.bisect_left(self.line_addrs, pc)
+        if i == len(self.line_addrs) or self.line_addrs[i] != pc:
+            return ""
+        return "%s:%i" % (self.source, self.line_numbers[i])
+
+    def describe(self, pc):
+
+        line = self.line(pc)
+        if line:
+            return "%s (%s)" % (self.label(pc), line)
+        return self.label(pc)
+
+def load_map(path):
+
+    f = open(path)
+    symbols = SymbolMap(f)
+    f.close()
+    return symbols